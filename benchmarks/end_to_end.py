@@ -0,0 +1,418 @@
+"""
+Measures the valuation endpoints end to end: the real app is started with its
+Spotify and Discogs URLs pointed at the local stand-ins of
+`benchmarks.fake_upstreams`, and driven through HTTP and WebSocket clients.
+
+For each library size, a fresh app process values `--clients` libraries at
+once through `/ws/calculate_all_albums`, `/all_albums_price` and
+`/get_albums_price`, first with cold caches and then again with warm ones.
+Throughput, p50 and p99 latency and the app's peak RSS are written to
+`--output` as JSON, and compared with `--baseline` when given.
+
+    uv run python -m benchmarks.end_to_end --sizes 100 1000 10000
+
+Needs the app's Redis, the results land in it under unique album names.
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+import orjson
+from websockets.asyncio.client import connect
+
+from benchmarks.fake_upstreams import (
+    FakeUpstreamSettings,
+    library_token,
+    parse_library_token,
+)
+
+API_PREFIX = "/api/v0/spotify"
+SCENARIOS = ("websocket", "all_albums_price", "get_albums_price")
+STARTUP_TIMEOUT = 30.0
+
+
+@dataclass
+class ScenarioResult:
+    albums: int
+    scenario: str
+    caches: str  # "cold" or "warm"
+    clients: int
+    priced_albums: int = 0
+    errors: int = 0
+    duration_seconds: float = 0.0
+    latencies: List[float] = field(default_factory=list)
+
+    def summary(self) -> dict:
+        summary = asdict(self)
+        latencies = summary.pop("latencies")
+
+        summary["albums_per_second"] = (
+            self.priced_albums / self.duration_seconds if self.duration_seconds else 0.0
+        )
+        summary["latency_p50_seconds"] = percentile(latencies, 0.5)
+        summary["latency_p99_seconds"] = percentile(latencies, 0.99)
+
+        return summary
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+
+    values = sorted(values)
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+def free_port() -> int:
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        return listener.getsockname()[1]
+
+
+def peak_rss_bytes(pid: int) -> Optional[int]:
+    # High water mark of the resident set, only exposed by Linux
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return None
+
+
+async def wait_until_ready(process: subprocess.Popen, url: str, headers: dict):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited with {process.returncode}")
+
+            try:
+                response = await client.get(url, headers=headers)
+                if response.status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+
+            await asyncio.sleep(0.1)
+
+    raise RuntimeError(f"{url} did not start within {STARTUP_TIMEOUT} seconds")
+
+
+def stop(process: subprocess.Popen):
+    process.terminate()
+
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def run_websocket(base_url: str, access_token: str, result: ScenarioResult):
+    url = f"{base_url.replace('http', 'ws', 1)}{API_PREFIX}/ws/calculate_all_albums"
+    started_at = time.monotonic()
+
+    async with connect(
+        url,
+        additional_headers={"Cookie": f"spotify_access_token={access_token}"},
+        max_size=None,
+    ) as websocket:
+        async for frame in websocket:
+            message = orjson.loads(frame)
+            messages = (
+                message["messages"] if message.get("type") == "batch" else [message]
+            )
+
+            for message in messages:
+                if message.get("type") == "album":
+                    result.priced_albums += 1
+                    result.latencies.append(time.monotonic() - started_at)
+                elif message.get("type") == "error" or "error" in message:
+                    result.errors += 1
+                elif message.get("type") == "complete":
+                    return
+
+
+async def run_all_albums_price(
+    client: httpx.AsyncClient, access_token: str, result: ScenarioResult
+):
+    started_at = time.monotonic()
+    response = await client.get(
+        f"{API_PREFIX}/all_albums_price",
+        cookies={"spotify_access_token": access_token},
+    )
+    result.latencies.append(time.monotonic() - started_at)
+
+    if response.status_code != 200:
+        result.errors += 1
+        return
+
+    result.priced_albums += len(response.json()["albums_with_price"])
+
+
+async def run_get_albums_price(
+    client: httpx.AsyncClient,
+    access_token: str,
+    result: ScenarioResult,
+    batch_size: int,
+):
+    # Prices the same albums the token's library holds, a batch per request
+    albums, label = parse_library_token(access_token)
+
+    for offset in range(0, albums, batch_size):
+        request = {
+            "albums": [
+                {
+                    "artist": f"{label} Artist {number}",
+                    "album_name": f"{label} Album {number}",
+                }
+                for number in range(offset, min(offset + batch_size, albums))
+            ]
+        }
+
+        started_at = time.monotonic()
+        response = await client.post(f"{API_PREFIX}/get_albums_price", json=request)
+        result.latencies.append(time.monotonic() - started_at)
+
+        if response.status_code != 200:
+            result.errors += 1
+            continue
+
+        result.priced_albums += len(response.json()["albums_with_price"])
+
+
+async def run_scenario(
+    base_url: str,
+    scenario: str,
+    access_tokens: List[str],
+    result: ScenarioResult,
+    batch_size: int,
+):
+    async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+        runs: Dict[str, Callable[[str], Awaitable]] = {
+            "websocket": lambda token: run_websocket(base_url, token, result),
+            "all_albums_price": lambda token: run_all_albums_price(
+                client, token, result
+            ),
+            "get_albums_price": lambda token: run_get_albums_price(
+                client, token, result, batch_size
+            ),
+        }
+
+        started_at = time.monotonic()
+        outcomes = await asyncio.gather(
+            *(runs[scenario](token) for token in access_tokens),
+            return_exceptions=True,
+        )
+        result.duration_seconds = time.monotonic() - started_at
+
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            result.errors += 1
+            print(f"Error running {scenario}: {outcome!r}")
+
+
+async def benchmark_size(
+    albums: int, upstreams_url: str, args: argparse.Namespace
+) -> dict:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+
+    env = {
+        **os.environ,
+        "SPOTIFY_API_URL": f"{upstreams_url}/spotify/v1",
+        "DISCOGS_API_URL": f"{upstreams_url}/discogs",
+        # The stand-ins have no quota to protect
+        "DISCOGS_REQUESTS_PER_MINUTE": "60000000",
+        "DISCOGS_RATE_LIMIT_BURST": "1000000",
+        "DISCOGS_WARMER_ENABLED": "false",
+        **dict(variable.split("=", 1) for variable in args.app_env),
+    }
+    app = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:create_app",
+            "--factory",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        env=env,
+    )
+
+    results = []
+    try:
+        await wait_until_ready(app, f"{base_url}{API_PREFIX}/websocket_stats", {})
+
+        # Unique album names, so every run starts from cold caches
+        run_id = f"{time.time_ns():x}"
+
+        for scenario in args.scenarios:
+            access_tokens = [
+                library_token(albums, f"{run_id}-{scenario}-{client}")
+                for client in range(args.clients)
+            ]
+
+            for caches in ("cold", "warm"):
+                result = ScenarioResult(albums, scenario, caches, args.clients)
+                await run_scenario(
+                    base_url, scenario, access_tokens, result, args.batch_size
+                )
+
+                summary = result.summary()
+                results.append(summary)
+                print(
+                    f"{albums:>6} albums {scenario:>16} {caches}: "
+                    f"{summary['albums_per_second']:9.1f} albums/s, "
+                    f"p50 {summary['latency_p50_seconds'] or 0:7.3f} s, "
+                    f"p99 {summary['latency_p99_seconds'] or 0:7.3f} s, "
+                    f"{result.errors} errors"
+                )
+
+        rss = peak_rss_bytes(app.pid)
+    finally:
+        stop(app)
+
+    return {"albums": albums, "peak_rss_bytes": rss, "scenarios": results}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict):
+    """
+    Prints the throughput and p99 latency of each scenario relative to the
+    baseline run.
+    """
+    baseline_scenarios = {
+        (summary["albums"], summary["scenario"], summary["caches"]): summary
+        for size in baseline["sizes"]
+        for summary in size["scenarios"]
+    }
+
+    for size in results["sizes"]:
+        for summary in size["scenarios"]:
+            key = (summary["albums"], summary["scenario"], summary["caches"])
+            previous = baseline_scenarios.get(key)
+            if previous is None:
+                continue
+
+            throughput = summary["albums_per_second"] / max(
+                previous["albums_per_second"], 1e-9
+            )
+            p99 = (summary["latency_p99_seconds"] or 0) / max(
+                previous["latency_p99_seconds"] or 0, 1e-9
+            )
+            print(
+                f"{key[0]:>6} albums {key[1]:>16} {key[2]}: "
+                f"throughput x{throughput:.2f}, p99 x{p99:.2f}"
+            )
+
+
+async def run(args: argparse.Namespace) -> dict:
+    upstream_settings = FakeUpstreamSettings(
+        spotify_latency=args.spotify_latency,
+        discogs_latency=args.discogs_latency,
+        discogs_429_every=args.discogs_429_every,
+    )
+
+    upstreams_port = free_port()
+    upstreams_url = f"http://127.0.0.1:{upstreams_port}"
+    upstreams = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.fake_upstreams",
+            "--port",
+            str(upstreams_port),
+            *(
+                argument
+                for name, value in upstream_settings.model_dump().items()
+                for argument in (f"--{name.replace('_', '-')}", str(value))
+            ),
+        ]
+    )
+
+    try:
+        await wait_until_ready(
+            upstreams,
+            f"{upstreams_url}/spotify/v1/me",
+            {"Authorization": f"Bearer {library_token(0, 'ready')}"},
+        )
+
+        sizes = [
+            await benchmark_size(albums, upstreams_url, args) for albums in args.sizes
+        ]
+    finally:
+        stop(upstreams)
+
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": git_commit(),
+        "clients": args.clients,
+        "batch_size": args.batch_size,
+        "app_env": args.app_env,
+        "upstreams": upstream_settings.model_dump(),
+        "sizes": sizes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the valuation endpoints against local stand-ins"
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--clients", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--spotify-latency", type=float, default=0.05)
+    parser.add_argument("--discogs-latency", type=float, default=0.05)
+    parser.add_argument("--discogs-429-every", type=int, default=0)
+    parser.add_argument(
+        "--app-env",
+        nargs="*",
+        default=[],
+        metavar="NAME=VALUE",
+        help="Extra settings for the app, e.g. JSON_FAST_ENCODER=true",
+    )
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    with open(args.output, "wb") as output:
+        output.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "rb") as baseline:
+            compare(results, orjson.loads(baseline.read()))
+
+
+if __name__ == "__main__":
+    main()
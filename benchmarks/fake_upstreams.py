@@ -0,0 +1,159 @@
+"""
+Local stand-ins for the Spotify and Discogs endpoints the valuation paths call,
+so the end to end benchmark never spends real quota.
+
+Spotify is served under /spotify/v1 and Discogs under /discogs, for the app's
+`SPOTIFY_API_URL` and `DISCOGS_API_URL`. Saved album pages have the full shape
+of Spotify's, tracks and markets included. Every access token is accepted, and
+the library it sees is derived from the token, see `library_token`, so each
+benchmark client can have its own library without any shared state.
+
+    uv run python -m benchmarks.fake_upstreams --port 9100 --discogs-latency 0.05
+"""
+
+import argparse
+import asyncio
+import hashlib
+from typing import Tuple
+
+import orjson
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+from benchmarks.spotify_album_page_parsing import build_album
+
+
+class FakeUpstreamSettings(BaseModel):
+    spotify_latency: float = 0.05  # Seconds per saved albums page
+    discogs_latency: float = 0.05  # Seconds per search or price suggestions call
+    max_page_size: int = 50  # Spotify's cap on `limit`
+    discogs_429_every: int = 0  # Answer every nth Discogs call with a 429, 0 never
+    not_found_every: int = 10  # Find no release for every nth album, 0 never
+
+
+def library_token(albums: int, label: str) -> str:
+    """
+    Access token whose library holds `albums` albums, named after `label` so
+    that libraries with different labels share no cached prices.
+    """
+    return f"{albums}.{label}"
+
+
+def parse_library_token(access_token: str) -> Tuple[int, str]:
+    albums, _, label = access_token.partition(".")
+    return int(albums), label
+
+
+def build_library_album(label: str, number: int) -> dict:
+    item = build_album(number)
+    item["album"]["id"] = f"{label}-album{number}"
+    item["album"]["name"] = f"{label} Album {number}"
+    item["album"]["artists"][0]["name"] = f"{label} Artist {number}"
+
+    return item
+
+
+def _access_token(request: Request) -> str:
+    return request.headers.get("Authorization", "").removeprefix("Bearer ")
+
+
+def _release_id(query: str) -> int:
+    return int.from_bytes(hashlib.blake2b(query.encode(), digest_size=4).digest())
+
+
+def _json(content) -> Response:
+    return Response(orjson.dumps(content), media_type="application/json")
+
+
+def create_fake_upstreams_app(settings: FakeUpstreamSettings) -> FastAPI:
+    app = FastAPI()
+    discogs_calls = 0
+
+    @app.get("/spotify/v1/me")
+    async def me(request: Request):
+        _, label = parse_library_token(_access_token(request))
+        return _json({"display_name": label, "id": label})
+
+    @app.get("/spotify/v1/me/albums")
+    async def saved_albums(request: Request, offset: int = 0, limit: int = 20):
+        albums, label = parse_library_token(_access_token(request))
+        limit = min(limit, settings.max_page_size)
+        await asyncio.sleep(settings.spotify_latency)
+
+        next_offset = offset + limit
+        return _json(
+            {
+                "href": f"{request.url}",
+                "limit": limit,
+                "next": None if next_offset >= albums else f"offset={next_offset}",
+                "offset": offset,
+                "previous": None,
+                "items": [
+                    build_library_album(label, number)
+                    for number in range(offset, min(next_offset, albums))
+                ],
+                "total": albums,
+            }
+        )
+
+    async def discogs_call() -> bool:
+        """
+        Counts a Discogs call and returns whether it is rate limited.
+        """
+        nonlocal discogs_calls
+        discogs_calls += 1
+        await asyncio.sleep(settings.discogs_latency)
+
+        return (
+            settings.discogs_429_every > 0
+            and discogs_calls % settings.discogs_429_every == 0
+        )
+
+    @app.get("/discogs/database/search")
+    async def search(q: str):
+        if await discogs_call():
+            return Response(status_code=429)
+
+        release_id = _release_id(q)
+        if settings.not_found_every and release_id % settings.not_found_every == 0:
+            return _json({"results": []})
+
+        return _json({"results": [{"id": release_id, "title": q}]})
+
+    @app.get("/discogs/marketplace/price_suggestions/{release_id}")
+    async def price_suggestions(release_id: int):
+        if await discogs_call():
+            return Response(status_code=429)
+
+        value = 5 + release_id % 4000 / 100
+        return _json(
+            {
+                "Very Good Plus (VG+)": {"currency": "EUR", "value": value},
+                "Good Plus (G+)": {"currency": "EUR", "value": value * 0.6},
+            }
+        )
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve the Spotify and Discogs stand-ins"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    for name, field in FakeUpstreamSettings.model_fields.items():
+        parser.add_argument(
+            f"--{name.replace('_', '-')}", type=field.annotation, default=field.default
+        )
+    args = vars(parser.parse_args())
+
+    host, port = args.pop("host"), args.pop("port")
+    app = create_fake_upstreams_app(FakeUpstreamSettings(**args))
+    uvicorn.run(app, host=host, port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
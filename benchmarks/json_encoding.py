@@ -0,0 +1,101 @@
+"""
+Compares FastAPI's default JSON encoding with the fast encoder enabled by
+`JSON_FAST_ENCODER`, for a large price response and for WebSocket frames.
+
+    uv run python -m benchmarks.json_encoding
+"""
+
+import json
+import time
+from decimal import Decimal
+from typing import Callable
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from gateways.app_values import AlbumsPriceResponse, AlbumsPriceResponseItem
+from services.json_encoding import dumps
+
+ALBUMS = 5000
+ROUNDS = 20
+
+
+def build_response() -> AlbumsPriceResponse:
+    albums_with_price = [
+        AlbumsPriceResponseItem(
+            artist=f"Artist {number}",
+            album_name=f"Album {number}",
+            price=Decimal(number % 40) + Decimal("0.99"),
+            valid=True,
+        )
+        for number in range(ALBUMS)
+    ]
+
+    return AlbumsPriceResponse(
+        albums_with_price=albums_with_price,
+        total=float(sum(album.price for album in albums_with_price)),
+        currency="EUR",
+    )
+
+
+def build_frames() -> list:
+    return [
+        {
+            "type": "album",
+            "index": number + 1,
+            "total": ALBUMS,
+            "album": {
+                "name": f"Album {number}",
+                "artist": f"Artist {number}",
+                "price": number % 40 + 0.99,
+                "valid": True,
+                "image": f"https://i.scdn.co/image/{number}",
+                "release_date": "2001-01-01",
+            },
+        }
+        for number in range(ALBUMS)
+    ]
+
+
+def encode_response_default(response: AlbumsPriceResponse) -> bytes:
+    # What FastAPI does with a model returned by a route
+    return JSONResponse(jsonable_encoder(response)).body
+
+
+def encode_frames_default(frames: list) -> list:
+    # What `WebSocket.send_json` does for each frame
+    return [
+        json.dumps(frame, separators=(",", ":"), ensure_ascii=False) for frame in frames
+    ]
+
+
+def encode_frames_fast(frames: list) -> list:
+    return [dumps(frame).decode() for frame in frames]
+
+
+def measure(name: str, encode: Callable, value) -> object:
+    started_at = time.process_time()
+    for _ in range(ROUNDS):
+        encoded = encode(value)
+    cpu_ms = (time.process_time() - started_at) * 1000 / ROUNDS
+
+    print(f"{name:>16}: {cpu_ms:8.2f} ms CPU")
+    return encoded
+
+
+def main():
+    response = build_response()
+    frames = build_frames()
+    print(f"{ALBUMS} albums")
+
+    default_body = measure("response default", encode_response_default, response)
+    fast_body = measure("response fast", lambda value: dumps(value), response)
+    assert default_body == fast_body
+
+    default_frames = measure("frames default", encode_frames_default, frames)
+    fast_frames = measure("frames fast", encode_frames_fast, frames)
+    assert default_frames == fast_frames
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Compares parsing a saved albums page into the full models and into the lean
+models used by the valuation paths.
+
+    uv run python -m benchmarks.spotify_album_page_parsing
+"""
+
+import json
+import time
+import tracemalloc
+from typing import Callable
+
+from values.spotify_values import SpotifyAlbumListResponse, parse_lean_album_list
+
+PAGE_SIZE = 50
+TRACKS_PER_ALBUM = 12
+ROUNDS = 200
+
+# Spotify lists around 180 markets for most albums and each of their tracks
+MARKETS = [
+    f"{first}{second}" for first in "ABCDEFGHIJKLM" for second in "ABCDEFGHIJKLMN"
+]
+
+
+def build_album(number: int) -> dict:
+    artist = {
+        "external_urls": {"spotify": f"https://open.spotify.com/artist/{number}"},
+        "href": f"https://api.spotify.com/v1/artists/{number}",
+        "id": f"artist{number}",
+        "name": f"Artist {number}",
+        "type": "artist",
+        "uri": f"spotify:artist:{number}",
+    }
+    tracks = [
+        {
+            "artists": [artist],
+            "available_markets": MARKETS,
+            "disc_number": 1,
+            "duration_ms": 240000,
+            "explicit": False,
+            "external_urls": {"spotify": f"https://open.spotify.com/track/{track}"},
+            "href": f"https://api.spotify.com/v1/tracks/{track}",
+            "id": f"track{number}-{track}",
+            "name": f"Track {track}",
+            "preview_url": None,
+            "track_number": track,
+            "type": "track",
+            "uri": f"spotify:track:{number}-{track}",
+            "is_local": False,
+        }
+        for track in range(1, TRACKS_PER_ALBUM + 1)
+    ]
+
+    return {
+        "added_at": "2024-01-01T00:00:00Z",
+        "album": {
+            "album_type": "album",
+            "total_tracks": TRACKS_PER_ALBUM,
+            "available_markets": MARKETS,
+            "external_urls": {"spotify": f"https://open.spotify.com/album/{number}"},
+            "href": f"https://api.spotify.com/v1/albums/{number}",
+            "id": f"album{number}",
+            "images": [
+                {
+                    "url": f"https://i.scdn.co/image/{number}-{size}",
+                    "height": size,
+                    "width": size,
+                }
+                for size in (640, 300, 64)
+            ],
+            "name": f"Album {number}",
+            "release_date": "2001-01-01",
+            "release_date_precision": "day",
+            "type": "album",
+            "uri": f"spotify:album:{number}",
+            "artists": [artist],
+            "tracks": {
+                "href": f"https://api.spotify.com/v1/albums/{number}/tracks",
+                "limit": 50,
+                "next": None,
+                "offset": 0,
+                "previous": None,
+                "total": TRACKS_PER_ALBUM,
+                "items": tracks,
+            },
+            "copyrights": [{"text": f"(C) {number}", "type": "C"}],
+            "external_ids": {"upc": f"{number:012d}"},
+            "genres": [],
+            "label": "Label",
+            "popularity": 50,
+        },
+    }
+
+
+def build_page() -> bytes:
+    return json.dumps(
+        {
+            "href": "https://api.spotify.com/v1/me/albums?offset=0&limit=50",
+            "limit": PAGE_SIZE,
+            "next": "https://api.spotify.com/v1/me/albums?offset=50&limit=50",
+            "offset": 0,
+            "previous": None,
+            "items": [build_album(number) for number in range(PAGE_SIZE)],
+            "total": PAGE_SIZE * 10,
+        }
+    ).encode()
+
+
+def parse_full(content: bytes) -> SpotifyAlbumListResponse:
+    # Mirrors the full path of `fetch_saved_albums_page`
+    return SpotifyAlbumListResponse(**json.loads(content))
+
+
+def measure(name: str, parse: Callable[[bytes], object], content: bytes):
+    started_at = time.process_time()
+    for _ in range(ROUNDS):
+        parse(content)
+    cpu_ms = (time.process_time() - started_at) * 1000 / ROUNDS
+
+    tracemalloc.start()
+    page = parse(content)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del page
+
+    print(
+        f"{name:>5}: {cpu_ms:7.2f} ms CPU per page, {peak_bytes / 1024:8.0f} KiB peak"
+    )
+
+
+def main():
+    content = build_page()
+    print(f"Page of {PAGE_SIZE} albums, {len(content) / 1024:.0f} KiB of JSON")
+
+    measure("full", parse_full, content)
+    measure("lean", parse_lean_album_list, content)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import asyncio
+import time
+from typing import Optional
+from pydantic import BaseModel
+
+from gateways.discogs_gateway import (
+    discogs_settings,
+    get_price_of_normalized_album,
+    rate_limiter,
+)
+from services.album_popularity import (
+    album_lookup_stats,
+    get_popular_albums,
+    mark_album_warmed,
+)
+from services.rate_limit import background_requests
+
+# Tokens an album refresh may take: a search and a price suggestions call
+TOKENS_PER_ALBUM = 2
+
+
+class CacheWarmerStats(BaseModel):
+    rounds: int = 0
+    warmed: int = 0
+    failed: int = 0
+    yielded: int = 0  # Rounds cut short to leave the quota to interactive use
+    busy_seconds: float = 0.0
+
+
+class CacheWarmer:
+    """
+    Refreshes the prices of the most requested albums before they go stale,
+    and prices popular albums that aren't cached, with the Discogs quota
+    interactive valuations leave unused.
+
+    Every `DISCOGS_WARMER_INTERVAL` seconds, the `DISCOGS_WARMER_CANDIDATES`
+    most requested albums are checked and those missing from the cache or
+    going stale within `DISCOGS_WARMER_REFRESH_AHEAD` seconds are priced one at
+    a time, most requested first. Albums cached without a price are left
+    alone until their negative entry expires.
+
+    Before each album, the warmer waits for the shared rate limiter to refill
+    the album's tokens on top of `DISCOGS_WARMER_RESERVE_TOKENS`. The round
+    stops as soon as the bucket drops below the reserve, i.e. interactive
+    traffic on any worker needs the quota, and resumes next round.
+    """
+
+    def __init__(self):
+        self.stats = CacheWarmerStats()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if not discogs_settings.warmer_enabled or self._task is not None:
+            return
+
+        needed_tokens = discogs_settings.warmer_reserve_tokens + TOKENS_PER_ALBUM
+        if needed_tokens > rate_limiter.capacity:
+            print("Cache warmer disabled, its reserve leaves no room in the burst")
+            return
+
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def wait_for_spare_quota(self) -> bool:
+        """
+        Waits until the rate limiter holds an album's tokens on top of the
+        reserve, and returns False instead if interactive callers drew the
+        bucket below the reserve.
+        """
+        reserve = discogs_settings.warmer_reserve_tokens
+        needed_tokens = reserve + TOKENS_PER_ALBUM
+        if needed_tokens > rate_limiter.capacity:
+            return False  # The bucket would never refill that far
+
+        while True:
+            spare_tokens = await rate_limiter.available_tokens()
+            if spare_tokens < reserve:
+                return False
+            if spare_tokens >= needed_tokens:
+                return True
+
+            await asyncio.sleep((needed_tokens - spare_tokens) / rate_limiter.rate)
+
+    async def warm_once(self):
+        self.stats.rounds += 1
+        started_at = time.monotonic()
+
+        try:
+            if not await self.wait_for_spare_quota():
+                self.stats.yielded += 1
+                return
+
+            albums = await get_popular_albums(discogs_settings.warmer_candidates)
+            freshness = await get_price_of_normalized_album.get_freshness_many(albums)
+
+            refresh_before = time.time() + discogs_settings.warmer_refresh_ahead
+            for album, cached in zip(albums, freshness):
+                if cached is not None:
+                    fresh_until, is_negative = cached
+                    if is_negative or fresh_until > refresh_before:
+                        continue
+
+                if not await self.wait_for_spare_quota():
+                    self.stats.yielded += 1
+                    return
+
+                await self._warm(album)
+        finally:
+            self.stats.busy_seconds += time.monotonic() - started_at
+
+    async def _warm(self, album: tuple):
+        token = background_requests.set(True)
+
+        try:
+            price = await get_price_of_normalized_album.compute(*album)
+        except Exception as e:
+            self.stats.failed += 1
+            print(f"Error warming the price of {album}: {str(e)}")
+            return
+        finally:
+            background_requests.reset(token)
+
+        await get_price_of_normalized_album.set_many([(album, price)])
+        await mark_album_warmed(album, warmed_window=discogs_settings.price_ttl)
+        self.stats.warmed += 1
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(discogs_settings.warmer_interval)
+
+            try:
+                await self.warm_once()
+            except Exception as e:
+                print(f"Error warming the price cache: {str(e)}")
+
+
+cache_warmer = CacheWarmer()
+
+
+def get_cache_warmer_stats() -> dict:
+    stats = cache_warmer.stats
+    hit_rate = album_lookup_stats.hits / max(album_lookup_stats.lookups, 1)
+    uplift = album_lookup_stats.warmed_hits / max(album_lookup_stats.lookups, 1)
+
+    return {
+        **stats.model_dump(),
+        "warmed_per_minute": (
+            stats.warmed / stats.busy_seconds * 60 if stats.busy_seconds else 0.0
+        ),
+        "quota_used": rate_limiter.stats.background_acquired,
+        "lookups": album_lookup_stats,
+        "hit_rate": hit_rate,
+        "hit_rate_without_warmer": hit_rate - uplift,
+        "hit_rate_uplift": uplift,
+    }
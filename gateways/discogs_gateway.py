@@ -1,94 +1,383 @@
-from typing import List
-import discogs_client
+import asyncio
+from typing import AsyncIterator, List, Optional, Tuple
 from fastapi import Request
+from httpx import Response
 
 from gateways.app_values import (
     AlbumsPriceRequest,
     AlbumsPriceResponse,
     AlbumsPriceResponseItem,
 )
-from services.cache import cache_response
-from values.discogs_values import DiscogsPriceSuggestions, DiscogsSettings
-from values.spotify_values import SpotifyAlbumListItem
+from services.album_popularity import record_album_lookups_in_background
+from services.cache import CachePolicy, cache_response
+from services.http_client import get_http_client
+from services.metrics import albums_priced, observe_upstream_call
+from services.normalization import build_search_query, normalize_album_lookup
+from services.rate_limit import TokenBucketLimiter
+from services.release_index import open_release_index
+from values.discogs_values import (
+    DiscogsPriceSuggestions,
+    DiscogsSearchResponse,
+    DiscogsSettings,
+)
+from values.spotify_values import LeanAlbumListItem
 from . import spotify_gateway
 
 
-def create_discogs_client() -> discogs_client.Client:
-    settings = DiscogsSettings()
-    return discogs_client.Client(
-        "SpotifyMoneyCalculator/1.0", user_token=settings.access_token
-    )
+discogs_settings = DiscogsSettings()
 
 
-client = create_discogs_client()
+def create_discogs_headers() -> dict:
+    headers = {"User-Agent": "SpotifyMoneyCalculator/1.0"}
+    if discogs_settings.access_token:
+        headers["Authorization"] = f"Discogs token={discogs_settings.access_token}"
 
+    return headers
 
-@cache_response(ttl=864000, namespace="albums")
-async def get_price_of_album(artist: str, album_name: str):
+
+discogs_headers = create_discogs_headers()
+
+release_index = open_release_index(discogs_settings.release_index_path)
+
+rate_limiter = TokenBucketLimiter(
+    "discogs",
+    requests_per_minute=discogs_settings.requests_per_minute,
+    burst=discogs_settings.rate_limit_burst,
+    max_wait=discogs_settings.rate_limit_max_wait,
+    limit_header="X-Discogs-Ratelimit",
+    remaining_header="X-Discogs-Ratelimit-Remaining",
+)
+
+
+async def discogs_get(call: str, url: str, params: Optional[dict] = None) -> Response:
     """
-    This function returns the price of the album and a bool that reflects whether it was
-    able to find the price for it or not
+    Sends a GET request to the Discogs API once the shared rate limiter allows it.
+    Requests rejected with a 429 are retried after the bucket refills. `call`
+    names the endpoint in the upstream latency metrics.
+    """
+    for _ in range(discogs_settings.max_retries + 1):
+        await rate_limiter.acquire()
+
+        with observe_upstream_call("discogs", call) as upstream_call:
+            response = await get_http_client().get(
+                f"{discogs_settings.api_url}{url}",
+                params=params,
+                headers=discogs_headers,
+            )
+            upstream_call.status = response.status_code
+        await rate_limiter.sync_from_headers(response.headers, response.status_code)
+
+        if response.status_code != 429:
+            break
+
+    response.raise_for_status()
+    return response
+
+
+async def has_spare_quota() -> bool:
+    """
+    Tells whether the shared rate limiter holds a token on top of the ones
+    `DISCOGS_WARMER_RESERVE_TOKENS` keeps for interactive lookups, so stale
+    prices, which are still served, are only refreshed with spare quota.
+    """
+    spare_tokens = await rate_limiter.available_tokens()
+    return spare_tokens >= discogs_settings.warmer_reserve_tokens + 1
+
+
+release_cache_policy = CachePolicy(
+    ttl=discogs_settings.release_ttl,
+    negative_ttl=discogs_settings.price_not_found_ttl,
+    jitter=discogs_settings.price_ttl_jitter,
+)
+
+price_suggestions_cache_policy = CachePolicy(
+    ttl=discogs_settings.price_suggestions_ttl,
+    negative_ttl=discogs_settings.price_not_found_ttl,
+    jitter=discogs_settings.price_ttl_jitter,
+)
+
+album_price_cache_policy = CachePolicy(
+    ttl=discogs_settings.price_ttl,
+    negative_ttl=discogs_settings.price_not_found_ttl,
+    stale_ttl=discogs_settings.price_stale_ttl,
+    jitter=discogs_settings.price_ttl_jitter,
+)
+
+
+@cache_response(
+    namespace="releases",
+    policy=release_cache_policy,
+    is_negative=lambda release_id: release_id is None,
+    coalesce=True,
+    hints=("upc",),
+)
+async def get_release_id(
+    artist: str, album_name: str, upc: Optional[str] = None
+) -> Optional[int]:
+    """
+    Returns the id of the Discogs release that best matches the album, or None
+    if the search finds nothing. Releases almost never change, so this is
+    cached much longer than prices.
 
-    :param albums_price_request_item: Description
-    :type albums_price_request_item: AlbumsPriceRequestItem
+    The local release index is checked first, by the album's UPC when known
+    and then by name, so only albums missing from it cost a search call. The
+    UPC isn't part of the cache key: editions of an album share one release.
     """
+    if release_index is not None:
+        release_id = release_index.lookup_barcode(upc) if upc else None
+        if release_id is None:
+            release_id = release_index.lookup(artist, album_name)
+        if release_id is not None:
+            return release_id
 
-    results = client.search(
-        f"{artist} - {album_name} CD",
-        type="release",
+    # Only the best match is used, so ask for a single result per page
+    response = await discogs_get(
+        "search",
+        "/database/search",
+        params={
+            "q": build_search_query(artist, album_name),
+            "type": "release",
+            "per_page": 1,
+            "page": 1,
+        },
     )
 
-    if not results:
-        return 0.0, False
+    search_response = DiscogsSearchResponse(**response.json())
 
-    release = results[0]
+    if not search_response.results:
+        return None
 
-    if not release:
-        return 0.0, False
+    return search_response.results[0].id
 
-    response = client._request(
-        "GET", f"https://api.discogs.com/marketplace/price_suggestions/{release.id}"
+
+@cache_response(
+    namespace="price_suggestions",
+    policy=price_suggestions_cache_policy,
+    is_negative=lambda price_suggestions: not price_suggestions,
+    coalesce=True,
+)
+async def get_price_suggestions_data(release_id: int) -> dict:
+    response = await discogs_get(
+        "price_suggestions", f"/marketplace/price_suggestions/{release_id}"
     )
 
-    price_suggestions = DiscogsPriceSuggestions(**response)
+    return response.json()
+
+
+async def get_price_suggestions(release_id: int) -> DiscogsPriceSuggestions:
+    return DiscogsPriceSuggestions(**await get_price_suggestions_data(release_id))
+
+
+@cache_response(
+    namespace="albums",
+    local=True,
+    policy=album_price_cache_policy,
+    is_negative=lambda album_price: not album_price[1],
+    coalesce=True,
+    can_refresh=has_spare_quota,
+    hints=("upc",),
+)
+async def get_price_of_normalized_album(
+    artist: str, album_name: str, upc: Optional[str] = None
+):
+    """
+    Prices an album whose artist and name were already normalized with
+    `normalize_album_lookup`, see `get_price_of_album`. The album's `upc`, if
+    known, helps find its release, see `get_release_id`.
+
+    The release and its price suggestions are cached separately, so refreshing
+    an expired price only costs the price suggestions call.
+    """
+    release_id = await get_release_id(artist, album_name, upc)
+
+    if release_id is None:
+        return 0.0, False
+
+    price_suggestions = await get_price_suggestions(release_id)
 
     response = price_suggestions.return_price_based_on_quality_vs_price()
 
     return response, True if response else False
 
 
-async def get_price_of_albums(
-    albums_price_request: AlbumsPriceRequest,
-) -> AlbumsPriceResponse:
-    response = AlbumsPriceResponse(albums_with_price=[], currency="EUR", total=0.0)
+async def get_price_of_album(artist: str, album_name: str):
+    """
+    This function returns the price of the album and a bool that reflects whether it was
+    able to find the price for it or not.
 
-    for album_request_item in albums_price_request.albums:
-        album_price, was_price_found = await get_price_of_album(
-            album_request_item.artist, album_request_item.album_name
-        )
-        response.albums_with_price.append(
-            AlbumsPriceResponseItem(
-                **album_request_item.__dict__, price=album_price, valid=was_price_found
-            )
-        )
+    Names are normalized first, so editions and remasters of an album share one
+    cached lookup.
+    """
+    return await get_price_of_normalized_album(
+        *normalize_album_lookup(artist, album_name)
+    )
 
-        response.total += album_price
 
-    return response
+PricingState = Tuple[List[Tuple[str, str]], dict, dict]
 
+albums_priced_from_cache = albums_priced.labels("cache")
+albums_priced_by_discogs = albums_priced.labels("discogs")
 
-async def get_all_ambums_price(request: Request) -> AlbumsPriceResponse:
-    response = AlbumsPriceResponse(albums_with_price=[], currency="EUR", total=0.0)
 
-    all_albums_response: List[SpotifyAlbumListItem] = (
-        await spotify_gateway.get_user_saved_albums(request=request, limit=-1) or []
+async def _start_pricing_albums(
+    albums: List[Tuple[str, str]], upcs: Optional[List[Optional[str]]] = None
+) -> PricingState:
+    """
+    Normalizes the albums, resolves the cached prices with one bulk lookup and
+    starts one pricing task per uncached album, with at most
+    `DISCOGS_CONCURRENCY` lookups in flight. `upcs`, if given, holds each
+    album's UPC or None.
+    """
+    semaphore = asyncio.Semaphore(discogs_settings.concurrency)
+
+    async def price_album(
+        artist: str, album_name: str, upc: Optional[str]
+    ) -> Tuple[float, bool]:
+        async with semaphore:
+            price = await get_price_of_normalized_album.compute(artist, album_name, upc)
+
+        albums_priced_by_discogs.inc()
+        return price
+
+    albums = [
+        normalize_album_lookup(artist, album_name) for artist, album_name in albums
+    ]
+    unique_albums = list(dict.fromkeys(albums))
+
+    # Editions sharing a lookup are priced with the first UPC known for them
+    upc_by_album = {}
+    for album, upc in zip(albums, upcs or ()):
+        if upc:
+            upc_by_album.setdefault(album, upc)
+    cached_prices = await get_price_of_normalized_album.get_many(unique_albums)
+
+    # Feeds the cache warmer, see gateways.cache_warmer
+    record_album_lookups_in_background(
+        unique_albums,
+        [is_cached for is_cached, _ in cached_prices],
+        warmed_window=discogs_settings.price_ttl,
+        half_life=discogs_settings.warmer_popularity_half_life,
     )
 
-    for album_response in all_albums_response:
-        artist = album_response.album.artists[0].name
-        album_name = album_response.album.name
+    price_by_album = {}
+    pricing_tasks = {}
+    for album, (is_cached, cached_price) in zip(unique_albums, cached_prices):
+        if is_cached:
+            price_by_album[album] = cached_price
+        else:
+            pricing_tasks[album] = asyncio.create_task(
+                price_album(*album, upc_by_album.get(album))
+            )
+
+    albums_priced_from_cache.inc(len(price_by_album))
 
-        album_price, was_price_found = await get_price_of_album(artist, album_name)
+    return albums, price_by_album, pricing_tasks
+
+
+async def _store_prices(price_by_album: dict, pricing_tasks: dict):
+    await get_price_of_normalized_album.set_many(
+        [
+            (album, price_by_album[album])
+            for album in pricing_tasks
+            if not isinstance(price_by_album[album], BaseException)
+        ]
+    )
+
+
+async def stream_prices_of_albums(
+    albums: List[Tuple[str, str]],
+    return_exceptions: bool = False,
+    upcs: Optional[List[Optional[str]]] = None,
+) -> AsyncIterator[Tuple[float, bool] | BaseException]:
+    """
+    Yields the price of each (artist, album_name) pair in input order, as soon as
+    it is known.
+
+    Names are normalized as in `get_price_of_album`. Cached prices are resolved
+    with one bulk lookup and repeated albums are only priced once. Only the
+    misses go to Discogs, with at most `DISCOGS_CONCURRENCY` lookups in flight,
+    and their prices are written back to the cache in one batch. As with
+    `asyncio.gather`, `return_exceptions` yields a failed lookup's exception
+    instead of raising it. `upcs`, if given, holds each album's UPC or None,
+    to find releases by barcode in the local release index.
+    """
+    albums, price_by_album, pricing_tasks = await _start_pricing_albums(albums, upcs)
+
+    try:
+        for album in albums:
+            if album not in price_by_album:
+                try:
+                    price_by_album[album] = await pricing_tasks[album]
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    price_by_album[album] = e
+
+            yield price_by_album[album]
+    finally:
+        for pricing_task in pricing_tasks.values():
+            pricing_task.cancel()
+
+    await _store_prices(price_by_album, pricing_tasks)
+
+
+async def stream_prices_of_albums_as_completed(
+    albums: List[Tuple[str, str]],
+    return_exceptions: bool = False,
+    upcs: Optional[List[Optional[str]]] = None,
+) -> AsyncIterator[Tuple[int, Tuple[float, bool] | BaseException]]:
+    """
+    Like `stream_prices_of_albums`, but yields (position, price) pairs as soon
+    as each price is known: cached prices first, then the Discogs lookups in
+    the order they complete.
+    """
+    albums, price_by_album, pricing_tasks = await _start_pricing_albums(albums, upcs)
+
+    positions_by_album = {}
+    for position, album in enumerate(albums):
+        positions_by_album.setdefault(album, []).append(position)
+
+    album_by_task = {task: album for album, task in pricing_tasks.items()}
+
+    try:
+        for position, album in enumerate(albums):
+            if album in price_by_album:
+                yield position, price_by_album[album]
+
+        async for pricing_task in asyncio.as_completed(album_by_task):
+            album = album_by_task[pricing_task]
+            try:
+                price_by_album[album] = pricing_task.result()
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                price_by_album[album] = e
+
+            for position in positions_by_album[album]:
+                yield position, price_by_album[album]
+    finally:
+        for pricing_task in pricing_tasks.values():
+            pricing_task.cancel()
+
+    await _store_prices(price_by_album, pricing_tasks)
+
+
+async def get_prices_of_albums(
+    albums: List[Tuple[str, str]], upcs: Optional[List[Optional[str]]] = None
+) -> List[Tuple[float, bool]]:
+    """
+    Prices a list of (artist, album_name) pairs, see `stream_prices_of_albums`.
+    The results are returned in the same order as the input.
+    """
+    return [price async for price in stream_prices_of_albums(albums, upcs=upcs)]
+
+
+def build_albums_price_response(
+    albums: List[Tuple[str, str]], prices: List[Tuple[float, bool]]
+) -> AlbumsPriceResponse:
+    response = AlbumsPriceResponse(albums_with_price=[], currency="EUR", total=0.0)
+
+    for (artist, album_name), (album_price, was_price_found) in zip(albums, prices):
         response.albums_with_price.append(
             AlbumsPriceResponseItem(
                 album_name=album_name,
@@ -101,3 +390,39 @@ async def get_all_ambums_price(request: Request) -> AlbumsPriceResponse:
         response.total += album_price
 
     return response
+
+
+async def get_price_of_albums(
+    albums_price_request: AlbumsPriceRequest,
+) -> AlbumsPriceResponse:
+    albums = [
+        (album_request_item.artist, album_request_item.album_name)
+        for album_request_item in albums_price_request.albums
+    ]
+
+    return build_albums_price_response(albums, await get_prices_of_albums(albums))
+
+
+async def get_all_ambums_price(request: Request) -> AlbumsPriceResponse:
+    access_token = request.cookies.get("spotify_access_token")
+    if not access_token:
+        return spotify_gateway.login()
+
+    all_albums_response: Optional[
+        List[LeanAlbumListItem]
+    ] = await spotify_gateway.get_all_albums_with_token(access_token, lean=True)
+    if all_albums_response is None:
+        return spotify_gateway.login()
+
+    albums = [
+        (album_response.album.artists[0].name, album_response.album.name)
+        for album_response in all_albums_response
+    ]
+    upcs = [
+        album_response.album.external_ids.upc
+        if album_response.album.external_ids
+        else None
+        for album_response in all_albums_response
+    ]
+
+    return build_albums_price_response(albums, await get_prices_of_albums(albums, upcs))
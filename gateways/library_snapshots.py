@@ -0,0 +1,226 @@
+import time
+from typing import List, Optional, Tuple
+from fastapi import Request
+from httpx import HTTPStatusError
+from pydantic import BaseModel
+from pydantic_settings import BaseSettings
+from redis.exceptions import RedisError
+
+from gateways import discogs_gateway, spotify_gateway
+from gateways.app_values import AlbumsPriceResponse
+from services.codec import deserialize, serialize
+from services.redis_client import get_redis
+from values.spotify_values import LeanAlbumListItem
+
+# (album_id, added_at, artist, album_name, price, was_price_found, priced_at)
+SnapshotEntry = Tuple[Optional[str], str, str, str, float, bool, float]
+
+
+class LibrarySnapshotSettings(BaseSettings):
+    ttl: int = 2592000
+
+    class Config:
+        env_prefix = "LIBRARY_SNAPSHOT_"
+
+
+library_snapshot_settings = LibrarySnapshotSettings()
+
+
+class LibrarySnapshotStats(BaseModel):
+    revaluations: int = 0
+    full_fetches: int = 0  # Revaluations that had to read the whole library
+    pages_fetched: int = 0
+    new_albums: int = 0
+    removed_albums: int = 0
+    repriced_albums: int = 0  # New albums and albums whose price expired
+
+
+library_snapshot_stats = LibrarySnapshotStats()
+
+
+def _snapshot_key(user_id: str) -> str:
+    return f"library_snapshot:{user_id}"
+
+
+async def load_snapshot(user_id: str) -> List[SnapshotEntry]:
+    try:
+        snapshot = await get_redis().get(_snapshot_key(user_id))
+        return (
+            []
+            if snapshot is None
+            else [tuple(entry) for entry in deserialize(snapshot)]
+        )
+    except (RedisError, ValueError) as e:
+        print(f"Error reading library snapshot of {user_id}: {str(e)}")
+        return []
+
+
+async def save_snapshot(user_id: str, entries: List[SnapshotEntry]):
+    try:
+        await get_redis().set(
+            _snapshot_key(user_id),
+            serialize(entries),
+            ex=library_snapshot_settings.ttl,
+        )
+    except (RedisError, TypeError, ValueError) as e:
+        print(f"Error saving library snapshot of {user_id}: {str(e)}")
+
+
+def _is_expired(entry: SnapshotEntry, now: float) -> bool:
+    _, _, _, _, _, was_price_found, priced_at = entry
+    ttl = (
+        discogs_gateway.discogs_settings.price_ttl
+        if was_price_found
+        else discogs_gateway.discogs_settings.price_not_found_ttl
+    )
+
+    return priced_at + ttl <= now
+
+
+def _new_entry(item: LeanAlbumListItem) -> SnapshotEntry:
+    artist = item.album.artists[0].name if item.album.artists else "Unknown Artist"
+    return item.album.id, item.added_at, artist, item.album.name, 0.0, False, 0.0
+
+
+async def _fetch_library_changes(
+    access_token: str, snapshot: List[SnapshotEntry]
+) -> List[SnapshotEntry | LeanAlbumListItem]:
+    """
+    Returns the library in Spotify's order, newest first, as snapshot entries
+    for the albums already known and as list items for the new ones.
+
+    Spotify lists saved albums by `added_at`, so pages are read until the
+    first album that is in the snapshot with the same `added_at`. The albums
+    after it are taken from the snapshot, minus those saved again since, if
+    that accounts for the library's total. Otherwise albums were removed
+    further down, and the rest of the library is read to find out which.
+    """
+    page_size = spotify_gateway.spotify_client_settings.page_size
+    position_by_album = {
+        (entry[0], entry[1]): position for position, entry in enumerate(snapshot)
+    }
+
+    new_items = []
+    known_position = None
+    offset = 0
+    total = None
+
+    while snapshot:
+        page = await spotify_gateway.fetch_saved_albums_page(
+            access_token, offset, page_size, lean=True
+        )
+        library_snapshot_stats.pages_fetched += 1
+
+        for item in page.items:
+            known_position = position_by_album.get((item.album.id, item.added_at))
+            if known_position is not None:
+                break
+            new_items.append(item)
+
+        offset += page_size
+        total = page.total
+        if known_position is not None or offset >= total:
+            break
+
+    if known_position is None and total is not None and offset >= total:
+        # Every page was read, none of the snapshot is left
+        return new_items
+
+    if known_position is not None:
+        new_album_ids = {item.album.id for item in new_items}
+        known_entries = [
+            entry
+            for entry in snapshot[known_position:]
+            if entry[0] not in new_album_ids
+        ]
+
+        if len(new_items) + len(known_entries) == total:
+            return [*new_items, *known_entries]
+
+    # Without a known album to stop at, or with albums removed further down,
+    # read the rest of the library
+    library_snapshot_stats.full_fetches += 1
+    entry_by_album = {(entry[0], entry[1]): entry for entry in snapshot}
+
+    library = list(new_items)
+    async for page in spotify_gateway.stream_saved_album_pages(
+        access_token, lean=True, start_offset=len(new_items)
+    ):
+        library_snapshot_stats.pages_fetched += 1
+        library.extend(
+            entry_by_album.get((item.album.id, item.added_at), item)
+            for item in page.items
+        )
+
+    return library
+
+
+async def revalue_library(user_id: str, access_token: str) -> AlbumsPriceResponse:
+    """
+    Values a library from the user's last snapshot: only the changes since are
+    read from Spotify, and only new albums and albums whose price expired are
+    priced again, through the price cache. The snapshot is then updated.
+    """
+    library_snapshot_stats.revaluations += 1
+    now = time.time()
+
+    snapshot = await load_snapshot(user_id)
+    library = await _fetch_library_changes(access_token, snapshot)
+
+    entries: List[SnapshotEntry] = [
+        _new_entry(entry) if isinstance(entry, LeanAlbumListItem) else entry
+        for entry in library
+    ]
+
+    library_album_ids = {entry[0] for entry in entries}
+    library_snapshot_stats.new_albums += sum(
+        isinstance(entry, LeanAlbumListItem) for entry in library
+    )
+    library_snapshot_stats.removed_albums += sum(
+        entry[0] not in library_album_ids for entry in snapshot
+    )
+
+    stale_positions = [
+        position for position, entry in enumerate(entries) if _is_expired(entry, now)
+    ]
+    prices = await discogs_gateway.get_prices_of_albums(
+        [(entries[position][2], entries[position][3]) for position in stale_positions]
+    )
+    library_snapshot_stats.repriced_albums += len(stale_positions)
+
+    for position, (album_price, was_price_found) in zip(stale_positions, prices):
+        album_id, added_at, artist, album_name, *_ = entries[position]
+        entries[position] = (
+            album_id,
+            added_at,
+            artist,
+            album_name,
+            album_price,
+            was_price_found,
+            now,
+        )
+
+    await save_snapshot(user_id, entries)
+
+    return discogs_gateway.build_albums_price_response(
+        [(entry[2], entry[3]) for entry in entries],
+        [(entry[4], entry[5]) for entry in entries],
+    )
+
+
+async def get_all_albums_price_incremental(request: Request) -> AlbumsPriceResponse:
+    access_token = request.cookies.get("spotify_access_token")
+    if not access_token:
+        return spotify_gateway.login()
+
+    spotify_user = await spotify_gateway.get_spotify_user(request)
+    if spotify_user is None:
+        return spotify_gateway.login()
+
+    try:
+        return await revalue_library(spotify_user.id, access_token)
+    except HTTPStatusError as e:
+        # The cached user outlived the token
+        if e.response.status_code == 401:
+            return spotify_gateway.login()
+        raise
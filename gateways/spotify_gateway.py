@@ -1,28 +1,51 @@
+import asyncio
 import base64
+import time
+from collections import deque
+from itertools import islice
 from fastapi import Request
 from fastapi.responses import FileResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
-from httpx import AsyncClient
 from dotenv import load_dotenv
 from values.spotify_values import (
+    LeanAlbumListItem,
+    LeanAlbumListResponse,
     SpotifyAlbumListItem,
     SpotifyAlbumListResponse,
     SpotifyAppCredentials,
+    SpotifyClientSettings,
     SpotifyUser,
     SpotifyUserCredentials,
+    parse_lean_album_list,
 )
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional, Union
+
+from services.cache import RedisCacheBackend, get_memory_cache, record_cache_lookup
+from services.http_client import get_http_client
+from services.metrics import observe_upstream_call
+from services.request_timing import timed_phase
+from services.tokens import hash_access_token
 
 load_dotenv()
 
 templates = Jinja2Templates(directory="static")
 
+spotify_client_settings = SpotifyClientSettings()
+
+# Saved album pages are parsed into the lean models when `lean` is set
+AlbumListResponse = Union[SpotifyAlbumListResponse, LeanAlbumListResponse]
+AlbumListItem = Union[SpotifyAlbumListItem, LeanAlbumListItem]
+
+ACCESS_TOKENS_NAMESPACE = "access_tokens"
+
+redis_cache = RedisCacheBackend()
+
 
 async def root(request: Request):
     access_token = request.cookies.get("spotify_access_token")
 
     if access_token:
-        spotify_user = await validate_access_token(access_token)
+        spotify_user = await get_spotify_user(request)
 
         if spotify_user:
             return templates.TemplateResponse(
@@ -62,13 +85,13 @@ async def callback(request: Request, code: str, state: str):
             status_code=403,
         )
 
-    async with AsyncClient() as client:
-        auth_string = (
-            f"{spotify_credentials.client_id}:{spotify_credentials.client_secret}"
-        )
-        auth_bytes = auth_string.encode("utf-8")
-        auth_base64 = base64.b64encode(auth_bytes).decode("utf-8")
+    client = get_http_client()
 
+    auth_string = f"{spotify_credentials.client_id}:{spotify_credentials.client_secret}"
+    auth_bytes = auth_string.encode("utf-8")
+    auth_base64 = base64.b64encode(auth_bytes).decode("utf-8")
+
+    with observe_upstream_call("spotify", "token") as upstream_call:
         response = await client.post(
             url="https://accounts.spotify.com/api/token",
             headers={
@@ -80,59 +103,70 @@ async def callback(request: Request, code: str, state: str):
                 "redirect_uri": spotify_credentials.redirect_url,
             },
         )
+        upstream_call.status = response.status_code
 
-        try:
-            response.raise_for_status()
-        except BaseException as e:
-            return templates.TemplateResponse(
-                "error.html",
-                {
-                    "request": request,
-                    "status_code": response.status_code,
-                    "error_message": str(e),
-                },
-                status_code=response.status_code,
-            )
+    try:
+        response.raise_for_status()
+    except BaseException as e:
+        return templates.TemplateResponse(
+            "error.html",
+            {
+                "request": request,
+                "status_code": response.status_code,
+                "error_message": str(e),
+            },
+            status_code=response.status_code,
+        )
 
-        user_credentials = SpotifyUserCredentials(**response.json())
+    user_credentials = SpotifyUserCredentials(**response.json())
 
-        html_response = templates.TemplateResponse(
-            "spotify_oauth_success.html",
-            {"request": request},
-            status_code=200,
-        )
+    html_response = templates.TemplateResponse(
+        "spotify_oauth_success.html",
+        {"request": request},
+        status_code=200,
+    )
 
-        html_response.set_cookie(
-            key="spotify_access_token",
-            value=user_credentials.access_token,
-            max_age=user_credentials.expires_in,
-            httponly=True,
-            secure=True,
-            samesite="lax",
-            path="/",
-        )
+    html_response.set_cookie(
+        key="spotify_access_token",
+        value=user_credentials.access_token,
+        max_age=user_credentials.expires_in,
+        httponly=True,
+        secure=True,
+        samesite="lax",
+        path="/",
+    )
 
-        html_response.set_cookie(
-            key="spotify_refresh_token",
-            value=user_credentials.refresh_token,
-            max_age=60 * 60 * 24 * 30,  # 30 days
-            httponly=True,
-            secure=True,
-            samesite="lax",
-            path="/",
-        )
+    html_response.set_cookie(
+        key="spotify_refresh_token",
+        value=user_credentials.refresh_token,
+        max_age=60 * 60 * 24 * 30,  # 30 days
+        httponly=True,
+        secure=True,
+        samesite="lax",
+        path="/",
+    )
 
-        html_response.set_cookie(
-            key="spotify_expires_in",
-            value=str(user_credentials.expires_in),
-            max_age=user_credentials.expires_in,
-            httponly=True,
-            secure=True,
-            samesite="lax",
-            path="/",
-        )
+    html_response.set_cookie(
+        key="spotify_access_token_expires_at",
+        value=str(int(time.time()) + user_credentials.expires_in),
+        max_age=user_credentials.expires_in,
+        httponly=True,
+        secure=True,
+        samesite="lax",
+        path="/",
+    )
+
+    html_response.set_cookie(
+        key="spotify_expires_in",
+        value=str(user_credentials.expires_in),
+        max_age=user_credentials.expires_in,
+        httponly=True,
+        secure=True,
+        samesite="lax",
+        path="/",
+    )
 
-        return html_response
+    return html_response
 
 
 async def validate_access_token(access_token: str) -> Optional[SpotifyUser]:
@@ -140,19 +174,157 @@ async def validate_access_token(access_token: str) -> Optional[SpotifyUser]:
     Validates the Spotify access token by making a request to the /me endpoint.
     Returns user data if valid, None if invalid.
     """
-    async with AsyncClient() as client:
-        try:
+    client = get_http_client()
+
+    try:
+        with observe_upstream_call("spotify", "me") as upstream_call:
             response = await client.get(
-                url="https://api.spotify.com/v1/me",
+                url=f"{spotify_client_settings.url}/me",
                 headers={
                     "Authorization": f"Bearer {access_token}",
                 },
             )
+            upstream_call.status = response.status_code
+
+        response.raise_for_status()
+        return SpotifyUser(**response.json())
+    except Exception:
+        return None
+
+
+def _access_token_cache_key(access_token: str) -> str:
+    # Only a hash of the token is ever stored
+    return f"{ACCESS_TOKENS_NAMESPACE}:{hash_access_token(access_token)}"
+
+
+async def get_spotify_user(request: Request) -> Optional[SpotifyUser]:
+    """
+    Cached `validate_access_token` for the request's access token, checked in
+    this worker's memory first and then in Redis. A user is cached until its
+    token expires, or for `SPOTIFY_API_TOKEN_CACHE_DEFAULT_TTL` seconds when
+    the expiry isn't known, and evicted as soon as Spotify rejects the token.
+    """
+    access_token = request.cookies.get("spotify_access_token")
+    if not access_token:
+        return None
+
+    key = _access_token_cache_key(access_token)
+    memory_cache = get_memory_cache(ACCESS_TOKENS_NAMESPACE)
+
+    is_cached, cached_user = memory_cache.get(key)
+    record_cache_lookup(ACCESS_TOKENS_NAMESPACE, "memory", is_cached)
+
+    if not is_cached:
+        is_cached, cached_user = await redis_cache.get(key)
+        record_cache_lookup(ACCESS_TOKENS_NAMESPACE, "redis", is_cached)
+
+        if is_cached:
+            user_data, expires_at = cached_user
+            memory_ttl = int(expires_at - time.time())
+            if memory_ttl > 0:
+                memory_cache.set(key, cached_user, memory_ttl)
+
+    if is_cached:
+        user_data, _ = cached_user
+        return SpotifyUser(**user_data)
+
+    spotify_user = await validate_access_token(access_token)
+    if spotify_user is None:
+        return None
+
+    try:
+        token_expires_at = float(request.cookies["spotify_access_token_expires_at"])
+        ttl = int(token_expires_at - time.time())
+    except (KeyError, ValueError):
+        ttl = spotify_client_settings.token_cache_default_ttl
+
+    ttl = min(ttl, spotify_client_settings.token_cache_max_ttl)
+    if ttl > 0:
+        cached_user = [spotify_user.model_dump(), time.time() + ttl]
+        memory_cache.set(key, cached_user, ttl)
+        await redis_cache.set(key, cached_user, ttl)
+
+    return spotify_user
+
 
-            response.raise_for_status()
-            return SpotifyUser(**response.json())
-        except Exception:
-            return None
+async def evict_access_token(access_token: str):
+    key = _access_token_cache_key(access_token)
+
+    get_memory_cache(ACCESS_TOKENS_NAMESPACE).delete(key)
+    await redis_cache.delete(key)
+
+
+async def fetch_saved_albums_page(
+    access_token: str, offset: int, limit: int, lean: bool = False
+) -> AlbumListResponse:
+    with observe_upstream_call("spotify", "saved_albums") as upstream_call:
+        response = await get_http_client().get(
+            url=f"{spotify_client_settings.url}/me/albums",
+            params={"offset": offset, "limit": limit},
+            headers={
+                "Authorization": f"Bearer {access_token}",
+            },
+        )
+        upstream_call.status = response.status_code
+
+    if response.status_code == 401:
+        await evict_access_token(access_token)
+
+    response.raise_for_status()
+
+    with timed_phase("spotify_parse"):
+        if lean:
+            return parse_lean_album_list(response.content)
+
+        return SpotifyAlbumListResponse(**response.json())
+
+
+async def stream_saved_album_pages(
+    access_token: str, lean: bool = False, start_offset: int = 0
+) -> AsyncIterator[AlbumListResponse]:
+    """
+    Yields every page of the user's saved albums in order.
+    The first page returns the total, so the offsets of the remaining pages are
+    known up front and they are fetched concurrently, with at most
+    `SPOTIFY_API_PAGE_CONCURRENCY` requests in flight.
+
+    With `lean`, pages are parsed into the lean models, which only hold the
+    fields the valuation needs. `start_offset` skips the albums before it.
+    """
+    page_size = spotify_client_settings.page_size
+
+    first_page = await fetch_saved_albums_page(
+        access_token, start_offset, page_size, lean
+    )
+    yield first_page
+
+    offsets = iter(range(start_offset + page_size, first_page.total, page_size))
+    pending = deque(
+        asyncio.create_task(
+            fetch_saved_albums_page(access_token, offset, page_size, lean)
+        )
+        for offset in islice(offsets, spotify_client_settings.page_concurrency)
+    )
+
+    try:
+        while pending:
+            page = await pending.popleft()
+
+            # Keep the window full while the caller processes this page
+            next_offset = next(offsets, None)
+            if next_offset is not None:
+                pending.append(
+                    asyncio.create_task(
+                        fetch_saved_albums_page(
+                            access_token, next_offset, page_size, lean
+                        )
+                    )
+                )
+
+            yield page
+    finally:
+        for task in pending:
+            task.cancel()
 
 
 async def get_user_saved_albums(
@@ -162,70 +334,38 @@ async def get_user_saved_albums(
     if not access_token:
         return login()
 
-    async with AsyncClient() as client:
-        try:
-            if limit == -1:
-                res = []
-                url = "https://api.spotify.com/v1/me/albums?limit=50"
-
-                while url != "":
-                    response = await client.get(
-                        url=url,
-                        headers={
-                            "Authorization": f"Bearer {access_token}",
-                        },
-                    )
-
-                    response.raise_for_status()
-                    list_response = SpotifyAlbumListResponse(**response.json())
-                    res += list_response.items
-                    url = list_response.next if list_response.next else ""
-                return res
-
-            else:
-                response = await client.get(
-                    url=f"https://api.spotify.com/v1/me/albums?limit={limit}",
-                    headers={
-                        "Authorization": f"Bearer {access_token}",
-                    },
-                )
+    try:
+        if limit == -1:
+            return [
+                item
+                async for page in stream_saved_album_pages(access_token)
+                for item in page.items
+            ]
 
-                response.raise_for_status()
+        else:
+            list_response = await fetch_saved_albums_page(access_token, 0, limit)
+            return list_response.items
 
-                return SpotifyAlbumListResponse(**response.json()).items
-
-        except Exception:
-            return login()
+    except Exception:
+        return login()
 
 
 async def get_all_albums_with_token(
-    access_token: str,
-) -> Optional[List[SpotifyAlbumListItem]]:
+    access_token: str, lean: bool = False
+) -> Optional[List[AlbumListItem]]:
     """
     Get all user saved albums using an access token directly.
     Used for WebSocket connections where cookies aren't available.
     """
-    async with AsyncClient() as client:
-        try:
-            res = []
-            url = "https://api.spotify.com/v1/me/albums?limit=50"
-
-            while url != "":
-                response = await client.get(
-                    url=url,
-                    headers={
-                        "Authorization": f"Bearer {access_token}",
-                    },
-                )
-
-                response.raise_for_status()
-                list_response = SpotifyAlbumListResponse(**response.json())
-                res += list_response.items
-                url = list_response.next if list_response.next else ""
-            return res
+    try:
+        return [
+            item
+            async for page in stream_saved_album_pages(access_token, lean)
+            for item in page.items
+        ]
 
-        except Exception:
-            return None
+    except Exception:
+        return None
 
 
 async def get_total_albums_count(access_token: str) -> Optional[int]:
@@ -233,57 +373,46 @@ async def get_total_albums_count(access_token: str) -> Optional[int]:
     Get the total count of user saved albums without fetching all items.
     Makes a single request to get the total count from the API.
     """
-    async with AsyncClient() as client:
-        try:
-            response = await client.get(
-                url="https://api.spotify.com/v1/me/albums?limit=1",
-                headers={
-                    "Authorization": f"Bearer {access_token}",
-                },
-            )
-
-            response.raise_for_status()
-            list_response = SpotifyAlbumListResponse(**response.json())
-            return list_response.total
+    try:
+        list_response = await fetch_saved_albums_page(access_token, 0, 1)
+        return list_response.total
 
-        except Exception:
-            return None
+    except Exception:
+        return None
 
 
-async def stream_albums_with_token(access_token: str):
+async def stream_album_pages_with_token(
+    access_token: str, lean: bool = False, start_offset: int = 0
+) -> AsyncIterator[AlbumListResponse]:
     """
-    Generator that streams user albums one by one without loading all into memory.
-    Yields (album_item, current_index, total_count) tuples.
+    Generator that streams user saved album pages using an access token directly.
+    Used for WebSocket connections where cookies aren't available.
     """
-    async with AsyncClient() as client:
-        try:
-            url = "https://api.spotify.com/v1/me/albums?limit=50"
-            total_count = None
-            current_index = 0
-
-            while url:
-                response = await client.get(
-                    url=url,
-                    headers={
-                        "Authorization": f"Bearer {access_token}",
-                    },
-                )
+    try:
+        async for list_response in stream_saved_album_pages(
+            access_token, lean, start_offset
+        ):
+            yield list_response
 
-                response.raise_for_status()
-                list_response = SpotifyAlbumListResponse(**response.json())
+    except Exception as e:
+        print(f"Error streaming albums: {str(e)}")
+        return
 
-                # Get total count on first request
-                if total_count is None:
-                    total_count = list_response.total
 
-                # Yield each album item
-                for item in list_response.items:
-                    current_index += 1
-                    yield item, current_index, total_count
-
-                # Get next page URL
-                url = list_response.next if list_response.next else ""
-
-        except Exception as e:
-            print(f"Error streaming albums: {str(e)}")
-            return
+async def stream_albums_with_token(access_token: str, lean: bool = False):
+    """
+    Generator that streams user albums one by one without loading all into memory.
+    Yields (album_item, current_index, total_count) tuples.
+    """
+    total_count = None
+    current_index = 0
+
+    async for list_response in stream_album_pages_with_token(access_token, lean):
+        # Get total count on first request
+        if total_count is None:
+            total_count = list_response.total
+
+        # Yield each album item
+        for item in list_response.items:
+            current_index += 1
+            yield item, current_index, total_count
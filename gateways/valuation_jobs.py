@@ -0,0 +1,258 @@
+import asyncio
+import time
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+from uuid import uuid4
+from pydantic import BaseModel
+from pydantic_settings import BaseSettings
+from redis.exceptions import RedisError
+
+from gateways import discogs_gateway, spotify_gateway
+from gateways.app_values import AlbumsPriceResponse
+from services.codec import deserialize, serialize
+from services.redis_client import get_redis
+from services.tokens import hash_access_token
+
+# Yields (total_albums, [(artist, album_name), ...]) for each page of a library
+FetchAlbumPages = Callable[[str], AsyncIterator[Tuple[int, List[Tuple[str, str]]]]]
+
+# Prices (artist, album_name) pairs, returning (price, was_price_found) in order
+PriceAlbums = Callable[[List[Tuple[str, str]]], Awaitable[List[Tuple[float, bool]]]]
+
+
+class ValuationJobSettings(BaseSettings):
+    workers: int = 2
+    max_queued_jobs: int = 100
+    ttl: int = 86400
+
+    class Config:
+        env_prefix = "VALUATION_JOB_"
+
+
+valuation_job_settings = ValuationJobSettings()
+
+
+class ValuationJobQueueFull(Exception):
+    pass
+
+
+class ValuationJobStats(BaseModel):
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    running: int = 0
+    queue_depth: int = 0
+    total_duration_seconds: float = 0.0
+    last_duration_seconds: Optional[float] = None
+
+
+async def fetch_saved_album_pages(
+    access_token: str,
+) -> AsyncIterator[Tuple[int, List[Tuple[str, str]]]]:
+    async for page in spotify_gateway.stream_saved_album_pages(access_token, lean=True):
+        yield (
+            page.total,
+            [
+                (
+                    item.album.artists[0].name
+                    if item.album.artists
+                    else "Unknown Artist",
+                    item.album.name,
+                )
+                for item in page.items
+            ],
+        )
+
+
+class ValuationJobRunner:
+    """
+    Values whole libraries in the background, so no request has to stay open
+    for the library fetch and every Discogs lookup.
+
+    Submitted jobs wait in a bounded in-process queue for one of `workers`
+    worker tasks, started with the app lifespan. The access token stays in
+    memory; the job status, progress and result are kept in Redis for
+    `VALUATION_JOB_TTL` seconds, so any worker can answer polls. Spotify and
+    Discogs are reached through `fetch_album_pages` and `price_albums`, which
+    can be replaced with in-process stand-ins.
+    """
+
+    def __init__(
+        self,
+        fetch_album_pages: FetchAlbumPages = fetch_saved_album_pages,
+        price_albums: PriceAlbums = discogs_gateway.get_prices_of_albums,
+        workers: int = valuation_job_settings.workers,
+        max_queued_jobs: int = valuation_job_settings.max_queued_jobs,
+    ):
+        self.fetch_album_pages = fetch_album_pages
+        self.price_albums = price_albums
+        self.workers = workers
+        self.stats = ValuationJobStats()
+
+        self._queue: asyncio.Queue = asyncio.Queue(max_queued_jobs)
+        self._worker_tasks: List[asyncio.Task] = []
+
+    def start(self):
+        if self._worker_tasks:
+            return
+
+        self._worker_tasks = [
+            asyncio.create_task(self._work()) for _ in range(self.workers)
+        ]
+
+    async def stop(self):
+        for worker_task in self._worker_tasks:
+            worker_task.cancel()
+
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def submit(self, access_token: str) -> str:
+        self.start()
+
+        # The slot is taken before any await, so concurrent submits can't
+        # both count on the last one
+        job_id = uuid4().hex
+        try:
+            self._queue.put_nowait((job_id, access_token))
+        except asyncio.QueueFull:
+            raise ValuationJobQueueFull()
+
+        self.stats.submitted += 1
+        self.stats.queue_depth = self._queue.qsize()
+
+        # A worker may already be running the job, keep its status if so
+        await self._save(
+            job_id,
+            {
+                "owner": hash_access_token(access_token),
+                "created_at": time.time(),
+            },
+            defaults={"status": "queued", "priced": 0},
+        )
+
+        return job_id
+
+    async def get_status(self, job_id: str, access_token: str) -> Optional[dict]:
+        """
+        Returns the job's status and progress, or None if there is no such job
+        for this access token.
+        """
+        try:
+            fields = await get_redis().hgetall(self._key(job_id))
+        except RedisError as e:
+            print(f"Error reading valuation job {job_id}: {str(e)}")
+            return None
+
+        fields = {name.decode(): value.decode() for name, value in fields.items()}
+        if fields.pop("owner", None) != hash_access_token(access_token):
+            return None
+
+        status = {"job_id": job_id, "status": fields.pop("status")}
+        for name, value in fields.items():
+            status[name] = value if name == "error" else float(value)
+
+        for name in ("priced", "total"):
+            if name in status:
+                status[name] = int(status[name])
+
+        return status
+
+    async def get_result(
+        self, job_id: str, access_token: str
+    ) -> Optional[AlbumsPriceResponse]:
+        status = await self.get_status(job_id, access_token)
+        if status is None or status["status"] != "done":
+            return None
+
+        try:
+            result = await get_redis().get(self._result_key(job_id))
+        except RedisError as e:
+            print(f"Error reading valuation job {job_id}: {str(e)}")
+            return None
+
+        if result is None:
+            return None
+
+        return AlbumsPriceResponse(**deserialize(result))
+
+    async def run_job(self, job_id: str, access_token: str):
+        started_at = time.monotonic()
+        await self._save(job_id, {"status": "running", "started_at": time.time()})
+
+        albums = []
+        prices = []
+
+        async for total, page_albums in self.fetch_album_pages(access_token):
+            albums.extend(page_albums)
+            prices.extend(await self.price_albums(page_albums))
+
+            await self._save(job_id, {"priced": len(prices), "total": total})
+
+        result = discogs_gateway.build_albums_price_response(albums, prices)
+
+        duration = time.monotonic() - started_at
+        await self._save(
+            job_id,
+            {"status": "done", "finished_at": time.time(), "duration": duration},
+            result=result.model_dump(),
+        )
+
+        self.stats.total_duration_seconds += duration
+        self.stats.last_duration_seconds = duration
+
+    async def _work(self):
+        while True:
+            job_id, access_token = await self._queue.get()
+            self.stats.queue_depth = self._queue.qsize()
+            self.stats.running += 1
+
+            try:
+                await self.run_job(job_id, access_token)
+                self.stats.completed += 1
+            except asyncio.CancelledError:
+                await self._save(job_id, {"status": "failed", "error": "Cancelled"})
+                raise
+            except Exception as e:
+                print(f"Error running valuation job {job_id}: {str(e)}")
+                self.stats.failed += 1
+                await self._save(
+                    job_id,
+                    {"status": "failed", "finished_at": time.time(), "error": str(e)},
+                )
+            finally:
+                self.stats.running -= 1
+                self._queue.task_done()
+
+    def _key(self, job_id: str) -> str:
+        return f"valuation_job:{job_id}"
+
+    def _result_key(self, job_id: str) -> str:
+        return f"{self._key(job_id)}:result"
+
+    async def _save(
+        self,
+        job_id: str,
+        fields: dict,
+        result: Optional[dict] = None,
+        defaults: Optional[dict] = None,
+    ):
+        """
+        Writes the job's fields, and its `defaults` fields unless they are
+        already set.
+        """
+        ttl = valuation_job_settings.ttl
+
+        try:
+            async with get_redis().pipeline(transaction=False) as pipeline:
+                if result is not None:
+                    pipeline.set(self._result_key(job_id), serialize(result), ex=ttl)
+                pipeline.hset(self._key(job_id), mapping=fields)
+                for name, value in (defaults or {}).items():
+                    pipeline.hsetnx(self._key(job_id), name, value)
+                pipeline.expire(self._key(job_id), ttl)
+                await pipeline.execute()
+        except (RedisError, TypeError, ValueError) as e:
+            print(f"Error saving valuation job {job_id}: {str(e)}")
+
+
+valuation_job_runner = ValuationJobRunner()
@@ -1,9 +1,44 @@
+from contextlib import asynccontextmanager
 import uvicorn
 from fastapi import APIRouter, FastAPI, Request
 
+from services.http_client import close_http_client, get_http_client
+from services.metrics import metrics_response
+from services.redis_client import close_redis
+from services.request_timing import RequestTimingMiddleware, request_timing_settings
+from services.websocket import close_event_publisher
+from services.websocket_batching import websocket_settings
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    from gateways.cache_warmer import cache_warmer
+    from gateways.valuation_jobs import valuation_job_runner
+
+    # One pooled HTTP client for the lifetime of the app, shared by all gateways
+    get_http_client()
+
+    # Workers for the background valuation jobs
+    valuation_job_runner.start()
+
+    # Spends the Discogs quota left over by interactive use on popular albums
+    cache_warmer.start()
+
+    yield
+
+    await cache_warmer.stop()
+    await valuation_job_runner.stop()
+    await close_event_publisher()
+    await close_http_client()
+    await close_redis()
+
 
 def create_app():
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
+
+    # Server-Timing headers and WebSocket timing frames for requests asking
+    if request_timing_settings.enabled:
+        app.add_middleware(RequestTimingMiddleware)
 
     @app.get("/")
     async def redirect_root(request: Request):
@@ -11,6 +46,10 @@ def create_app():
 
         return await root(request)
 
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return metrics_response()
+
     from router import router
 
     version_router = APIRouter()
@@ -30,6 +69,7 @@ def main():
         factory=True,
         log_level="debug",
         reload=True,
+        ws_per_message_deflate=websocket_settings.per_message_deflate,
     )
 
 
@@ -1,11 +1,39 @@
-from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect
+from fastapi import (
+    APIRouter,
+    HTTPException,
+    Request,
+    WebSocket,
+    WebSocketDisconnect,
+)
 from gateways import spotify_gateway
 from gateways.app_values import AlbumsPriceRequest
-from gateways import discogs_gateway
+from gateways import discogs_gateway, library_snapshots
+from gateways.cache_warmer import get_cache_warmer_stats
+from gateways.valuation_jobs import ValuationJobQueueFull, valuation_job_runner
+from services.cache import get_cache_stats
+from services.json_encoding import json_response
+from services.metrics import websocket_valuations_in_progress
+from services.request_timing import get_timing_summary
+from services.normalization import normalization_stats
+from services.valuation_sessions import open_valuation_session
+from services.websocket_batching import (
+    MessageSender,
+    get_websocket_stats,
+    negotiate_batching,
+)
 
 router = APIRouter()
 
 
+async def send_complete(sender: MessageSender):
+    # Timed sessions get their timing breakdown right before completing
+    timing_summary = get_timing_summary()
+    if timing_summary is not None:
+        await sender.send(timing_summary)
+
+    await sender.send({"type": "complete"})
+
+
 @router.get("/")
 async def root(request: Request):
     return await spotify_gateway.root(request=request)
@@ -28,54 +56,183 @@ async def user_albums(request: Request, limit: int):
 
 @router.post("/get_albums_price")
 async def get_albums_price(albums_price_request: AlbumsPriceRequest):
-    return await discogs_gateway.get_price_of_albums(albums_price_request)
+    return json_response(
+        await discogs_gateway.get_price_of_albums(albums_price_request)
+    )
 
 
 @router.get("/all_albums_price")
-async def get_all_ambums_price(request: Request):
-    return await discogs_gateway.get_all_ambums_price(request=request)
+async def get_all_ambums_price(request: Request, incremental: bool = False):
+    if incremental:
+        return json_response(
+            await library_snapshots.get_all_albums_price_incremental(request=request)
+        )
+
+    return json_response(await discogs_gateway.get_all_ambums_price(request=request))
+
+
+@router.post("/valuation_jobs", status_code=202)
+async def create_valuation_job(request: Request):
+    access_token = request.cookies.get("spotify_access_token")
+    if not access_token:
+        return spotify_gateway.login()
+
+    try:
+        job_id = await valuation_job_runner.submit(access_token)
+    except ValuationJobQueueFull:
+        raise HTTPException(status_code=503, detail="Too many valuation jobs queued")
+
+    return {"job_id": job_id, "status": "queued"}
+
+
+@router.get("/valuation_jobs/{job_id}")
+async def get_valuation_job(request: Request, job_id: str):
+    status = await valuation_job_runner.get_status(
+        job_id, request.cookies.get("spotify_access_token", "")
+    )
+    if status is None:
+        raise HTTPException(status_code=404, detail="Valuation job not found")
+
+    return status
+
+
+@router.get("/valuation_jobs/{job_id}/result")
+async def get_valuation_job_result(request: Request, job_id: str):
+    result = await valuation_job_runner.get_result(
+        job_id, request.cookies.get("spotify_access_token", "")
+    )
+    if result is None:
+        raise HTTPException(status_code=404, detail="Valuation job result not found")
+
+    return json_response(result)
+
+
+@router.get("/valuation_job_stats")
+async def valuation_job_stats():
+    return valuation_job_runner.stats
+
+
+@router.get("/discogs_rate_limit")
+async def discogs_rate_limit():
+    return discogs_gateway.rate_limiter.stats
+
+
+@router.get("/cache_stats")
+async def cache_stats():
+    return {
+        **get_cache_stats(),
+        "normalization": normalization_stats,
+        "library_snapshots": library_snapshots.library_snapshot_stats,
+    }
+
+
+@router.get("/cache_warmer_stats")
+async def cache_warmer_stats():
+    return get_cache_warmer_stats()
+
+
+@router.get("/websocket_stats")
+async def websocket_stats():
+    return get_websocket_stats()
 
 
 @router.websocket("/ws/calculate_all_albums")
 async def websocket_calculate_all_albums(websocket: WebSocket):
-    await websocket.accept()
+    is_batched, subprotocol = negotiate_batching(websocket)
+    await websocket.accept(subprotocol=subprotocol)
+
+    # One message per frame unless the client asked for batched frames
+    sender = MessageSender(websocket, is_batched=is_batched)
+    websocket_valuations_in_progress.inc()
 
     try:
         # Get access token from cookies
         access_token = websocket.cookies.get("spotify_access_token")
 
         if not access_token:
-            await websocket.send_json({"error": "No access token provided"})
+            await sender.send({"error": "No access token provided"})
+            await sender.close()
             await websocket.close()
             return
 
-        # Stream albums one by one without loading all into memory
-        async for (
-            album_item,
-            current_index,
-            total_count,
-        ) in spotify_gateway.stream_albums_with_token(access_token):
-            try:
-                # Send total count on first album
-                if current_index == 1:
-                    await websocket.send_json(
-                        {"type": "total", "total_albums": total_count}
-                    )
-
-                album = album_item.album
-                artist = album.artists[0].name if album.artists else "Unknown Artist"
-                album_name = album.name
-
-                # Get price for this album
-                album_price, was_price_found = await discogs_gateway.get_price_of_album(
-                    artist, album_name
+        # Reconnecting with the session id of an interrupted valuation replays
+        # its finished albums and prices only the rest
+        session = await open_valuation_session(
+            access_token, websocket.query_params.get("session_id")
+        )
+        await sender.send({"type": "session", "session_id": session.session_id})
+
+        total_count = session.total
+        if total_count is not None:
+            await sender.send({"type": "total", "total_albums": total_count})
+
+        for index in sorted(session.results):
+            await sender.send(session.results[index])
+
+        if session.is_complete:
+            await send_complete(sender)
+            await sender.close()
+            return
+
+        # Stream album pages without loading the whole library into memory
+        async for list_response in spotify_gateway.stream_album_pages_with_token(
+            access_token,
+            lean=True,
+            start_offset=session.first_unfinished_index() - 1,
+        ):
+            # Send total count on first page
+            if total_count is None:
+                total_count = list_response.total
+                await session.save_total(total_count)
+                await sender.send({"type": "total", "total_albums": total_count})
+
+            # Albums are numbered by their position in the library
+            unfinished_items = [
+                (list_response.offset + position + 1, album_item.album)
+                for position, album_item in enumerate(list_response.items)
+                if list_response.offset + position + 1 not in session.results
+            ]
+
+            albums = [
+                (
+                    album.artists[0].name if album.artists else "Unknown Artist",
+                    album.name,
                 )
+                for _, album in unfinished_items
+            ]
+
+            upcs = [
+                album.external_ids.upc if album.external_ids else None
+                for _, album in unfinished_items
+            ]
+
+            # Cached prices for the whole page are resolved at once, the rest
+            # are sent as soon as Discogs returns them, tagged with their index
+            album_prices = discogs_gateway.stream_prices_of_albums_as_completed(
+                albums, return_exceptions=True, upcs=upcs
+            )
+
+            # The page's finished albums are saved to the session in one write,
+            # also when the client disconnects halfway through the page
+            finished_albums = {}
+            try:
+                async for position, album_price in album_prices:
+                    index, album = unfinished_items[position]
+                    artist, album_name = albums[position]
 
-                # Send album data with price
-                await websocket.send_json(
-                    {
+                    if isinstance(album_price, BaseException):
+                        error = f"Error processing album: {str(album_price)}"
+                        await sender.send(
+                            {"type": "error", "index": index, "message": error}
+                        )
+                        continue
+
+                    album_price, was_price_found = album_price
+
+                    # Send album data with price
+                    album_message = {
                         "type": "album",
-                        "index": current_index,
+                        "index": index,
                         "total": total_count,
                         "album": {
                             "name": album_name,
@@ -86,25 +243,31 @@ async def websocket_calculate_all_albums(websocket: WebSocket):
                             "release_date": album.release_date,
                         },
                     }
-                )
+                    finished_albums[index] = album_message
+                    await sender.send(album_message)
+            finally:
+                await session.save_results(finished_albums)
 
-            except Exception as e:
-                await websocket.send_json(
-                    {"type": "error", "message": f"Error processing album: {str(e)}"}
-                )
+        # Albums that failed stay unfinished, to be retried on reconnection
+        if total_count is not None and len(session.results) >= total_count:
+            await session.mark_complete()
 
         # Send completion message
-        await websocket.send_json({"type": "complete"})
+        await send_complete(sender)
+        await sender.close()
 
     except WebSocketDisconnect:
         print("Client disconnected")
     except Exception as e:
         print(f"WebSocket error: {str(e)}")
         try:
-            await websocket.send_json({"error": str(e)})
+            await sender.send({"error": str(e)})
         except BaseException:
             pass
     finally:
+        websocket_valuations_in_progress.dec()
+        await sender.close()
+
         try:
             await websocket.close()
         except BaseException:
@@ -0,0 +1,122 @@
+import time
+from typing import List, Tuple
+from pydantic import BaseModel
+from redis.exceptions import RedisError
+
+from services.cache import create_background_task
+from services.codec import deserialize, serialize
+from services.redis_client import get_redis
+
+# Sorted set of normalized (artist, album_name) pairs by how many valuations
+# looked them up, and sorted set of the pairs warmed by when they were warmed
+POPULARITY_KEY = "album_popularity"
+WARMED_KEY = "album_popularity:warmed"
+
+# Set while the lookup counts were decayed in the last `DECAY_INTERVAL`
+DECAYED_KEY = "album_popularity:decayed"
+
+# Seconds between decays of the lookup counts, which also drop the least
+# requested albums past `MAX_TRACKED_ALBUMS`
+DECAY_INTERVAL = 3600
+MAX_TRACKED_ALBUMS = 10000
+
+
+class AlbumLookupStats(BaseModel):
+    lookups: int = 0
+    hits: int = 0
+    warmed_hits: int = 0  # Hits on prices the cache warmer refreshed
+
+
+album_lookup_stats = AlbumLookupStats()
+
+
+async def record_album_lookups(
+    albums: List[Tuple[str, str]],
+    cached: List[bool],
+    warmed_window: int,
+    half_life: int,
+):
+    """
+    Counts a lookup of each normalized album, and which of the cache hits
+    were for prices warmed in the last `warmed_window` seconds.
+
+    Once per `DECAY_INTERVAL` across all workers, the counts are scaled down
+    so that they halve every `half_life` seconds, and the least requested
+    albums are dropped. Albums that stop being requested fade out instead of
+    staying popular on old lookups.
+    """
+    if not albums:
+        return
+
+    hit_members = [
+        serialize(album) for album, is_cached in zip(albums, cached) if is_cached
+    ]
+
+    try:
+        async with get_redis().pipeline(transaction=False) as pipeline:
+            for album in albums:
+                pipeline.zincrby(POPULARITY_KEY, 1, serialize(album))
+            pipeline.set(DECAYED_KEY, 1, nx=True, ex=DECAY_INTERVAL)
+            if hit_members:
+                pipeline.zmscore(WARMED_KEY, hit_members)
+            results = await pipeline.execute()
+    except RedisError as e:
+        print(f"Error recording {len(albums)} album lookups: {str(e)}")
+        return
+
+    album_lookup_stats.lookups += len(albums)
+    album_lookup_stats.hits += len(hit_members)
+
+    if hit_members:
+        warmed_after = time.time() - warmed_window
+        album_lookup_stats.warmed_hits += sum(
+            warmed_at is not None and warmed_at >= warmed_after
+            for warmed_at in results[-1]
+        )
+
+    if results[len(albums)]:
+        await decay_album_popularity(0.5 ** (DECAY_INTERVAL / half_life))
+
+
+async def decay_album_popularity(factor: float):
+    try:
+        async with get_redis().pipeline(transaction=False) as pipeline:
+            pipeline.zunionstore(POPULARITY_KEY, {POPULARITY_KEY: factor})
+            pipeline.zremrangebyrank(POPULARITY_KEY, 0, -MAX_TRACKED_ALBUMS - 1)
+            await pipeline.execute()
+    except RedisError as e:
+        print(f"Error decaying album popularity: {str(e)}")
+
+
+def record_album_lookups_in_background(
+    albums: List[Tuple[str, str]],
+    cached: List[bool],
+    warmed_window: int,
+    half_life: int,
+):
+    # Keeps the bookkeeping off the valuation's critical path
+    create_background_task(
+        record_album_lookups(albums, cached, warmed_window, half_life)
+    )
+
+
+async def get_popular_albums(limit: int) -> List[Tuple[str, str]]:
+    try:
+        members = await get_redis().zrevrange(POPULARITY_KEY, 0, limit - 1)
+    except RedisError as e:
+        print(f"Error reading popular albums: {str(e)}")
+        return []
+
+    return [deserialize(member) for member in members]
+
+
+async def mark_album_warmed(album: Tuple[str, str], warmed_window: int):
+    now = time.time()
+
+    try:
+        async with get_redis().pipeline(transaction=False) as pipeline:
+            pipeline.zadd(WARMED_KEY, {serialize(album): now})
+            pipeline.zremrangebyscore(WARMED_KEY, "-inf", now - warmed_window)
+            await pipeline.execute()
+    except RedisError as e:
+        print(f"Error recording warmed album: {str(e)}")
@@ -1,56 +1,541 @@
-import json
-from functools import wraps
-from aiocache import Cache
-from fastapi import HTTPException
+import asyncio
+import hashlib
+import inspect
+import random
+import time
+from collections import OrderedDict, defaultdict
+from functools import lru_cache, wraps
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+import msgpack
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
+from redis.exceptions import RedisError
 
+from services.codec import deserialize, serialize
+from services.metrics import observe_upstream_call
+from services.rate_limit import background_requests
+from services.redis_client import get_redis
+from services.single_flight import SingleFlight
 
-class RedisSetting(BaseSettings):
-    port: int = 6379
-    host: str = "localhost"
+
+class CacheSettings(BaseSettings):
+    local_max_entries: int = 10000
+    local_max_bytes: int = 8 * 1024 * 1024
+    local_ttl: int = 3600
+    max_refreshes: int = 4  # Background refreshes in flight per namespace
+    single_flight_lock_ttl: float = 10.0
+    single_flight_poll_interval: float = 0.1
 
     class Config:
-        env_prefix = "REDIS_"
+        env_prefix = "CACHE_"
+
+
+cache_settings = CacheSettings()
+
+
+@lru_cache(maxsize=None)
+def _get_signature(func) -> inspect.Signature:
+    return inspect.signature(func)
+
+
+def make_cache_key(
+    namespace: str, func, args: tuple, kwargs: dict, hints: Tuple[str, ...] = ()
+) -> str:
+    """
+    Builds a stable key for a call. Arguments are bound to the function
+    signature first, so positional, keyword and defaulted arguments produce the
+    same key, and the normalized arguments are hashed to keep keys short. The
+    `hints` arguments are left out of the key.
+    """
+    bound_arguments = _get_signature(func).bind(*args, **kwargs)
+    bound_arguments.apply_defaults()
+    for name in hints:
+        bound_arguments.arguments.pop(name, None)
+
+    packed_arguments = msgpack.packb(
+        sorted(bound_arguments.arguments.items()), default=str
+    )
+    digest = hashlib.sha256(packed_arguments).hexdigest()
+
+    return f"{namespace}:{func.__module__}.{func.__qualname__}:{digest}"
+
+
+class RedisCacheBackend:
+    """
+    Cache backend on top of the process-wide Redis pool.
+    Redis and serialization errors are reported and treated as misses, so a
+    broken cache only costs the upstream call it was meant to save.
+    """
+
+    async def get(self, key: str) -> Tuple[bool, Any]:
+        try:
+            with observe_upstream_call("redis", "get"):
+                cached_value = await get_redis().get(key)
+            if cached_value is None:
+                return False, None
+
+            return True, deserialize(cached_value)
+        except (RedisError, ValueError) as e:
+            print(f"Error reading {key} from cache: {str(e)}")
+            return False, None
+
+    async def set(self, key: str, value: Any, ttl: int):
+        try:
+            with observe_upstream_call("redis", "set"):
+                await get_redis().set(key, serialize(value), ex=ttl)
+        except (RedisError, TypeError, ValueError) as e:
+            print(f"Error caching {key}: {str(e)}")
+
+    async def delete(self, key: str):
+        try:
+            with observe_upstream_call("redis", "delete"):
+                await get_redis().delete(key)
+        except RedisError as e:
+            print(f"Error deleting {key} from cache: {str(e)}")
+
+    async def get_many(self, keys: List[str]) -> List[Tuple[bool, Any]]:
+        """
+        Reads every key with a single MGET.
+        """
+        if not keys:
+            return []
+
+        try:
+            with observe_upstream_call("redis", "mget"):
+                cached_values = await get_redis().mget(keys)
+        except RedisError as e:
+            print(f"Error reading {len(keys)} keys from cache: {str(e)}")
+            return [(False, None)] * len(keys)
+
+        results = []
+        for cached_value in cached_values:
+            try:
+                results.append(
+                    (False, None)
+                    if cached_value is None
+                    else (True, deserialize(cached_value))
+                )
+            except ValueError:
+                results.append((False, None))
+
+        return results
+
+    async def set_many(self, items: List[Tuple[str, Any, int]]):
+        """
+        Writes every (key, value, ttl) item in one pipelined round trip.
+        """
+        if not items:
+            return
+
+        try:
+            async with get_redis().pipeline(transaction=False) as pipeline:
+                for key, value, ttl in items:
+                    pipeline.set(key, serialize(value), ex=ttl)
+
+                with observe_upstream_call("redis", "set_many"):
+                    await pipeline.execute()
+        except (RedisError, TypeError, ValueError) as e:
+            print(f"Error caching {len(items)} keys: {str(e)}")
+
+
+class MemoryCacheBackend:
+    """
+    Bounded LRU cache kept in the worker's memory, used as a first tier in front
+    of Redis. Values are stored packed, so callers can't mutate cached entries
+    and their size is known. The least recently used entries are evicted once
+    either `max_entries` or `max_bytes` is exceeded.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.evictions = 0
+
+        self._entries: OrderedDict[str, Tuple[float, bytes]] = OrderedDict()
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+
+        expires_at, data = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return False, None
+
+        self._entries.move_to_end(key)
+        return True, deserialize(data)
+
+    def set(self, key: str, value: Any, ttl: int):
+        try:
+            data = serialize(value)
+        except (TypeError, ValueError):
+            return
 
+        if len(data) > self.max_bytes:
+            return
 
-redis_settings = RedisSetting()
+        if key in self._entries:
+            self._remove(key)
 
+        self._entries[key] = (time.monotonic() + ttl, data)
+        self.size_bytes += len(data)
+
+        while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def delete(self, key: str):
+        if key in self._entries:
+            self._remove(key)
+
+    def _remove(self, key: str):
+        _, data = self._entries.pop(key)
+        self.size_bytes -= len(data)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class CachePolicy(BaseModel):
+    """
+    How long results stay cached.
 
-def cache_response(ttl: int = 60, namespace: str = "main"):
+    ttl: Seconds a result is fresh.
+    negative_ttl: Seconds a negative result (e.g. nothing found) is fresh,
+        defaults to `ttl`.
+    stale_ttl: Seconds a result is still served after it stops being fresh,
+        while it is refreshed in the background. Negative results are never
+        served stale.
+    jitter: Fraction by which each TTL is randomly shortened or lengthened, so
+        entries written together don't all expire together.
     """
-    Caching decorator for FastAPI endpoints.
 
-    ttl: Time to live for the cache in seconds.
+    ttl: int
+    negative_ttl: Optional[int] = None
+    stale_ttl: int = 0
+    jitter: float = 0.0
+
+    def lifetimes(self, is_negative: bool) -> Tuple[int, int]:
+        """
+        Returns how many seconds a new result is fresh and how many seconds
+        it is kept in total.
+        """
+        fresh_ttl = self.negative_ttl if is_negative and self.negative_ttl else self.ttl
+        fresh_ttl = max(
+            1, round(fresh_ttl * random.uniform(1 - self.jitter, 1 + self.jitter))
+        )
+
+        return fresh_ttl, fresh_ttl + (0 if is_negative else self.stale_ttl)
+
+
+class CacheTierStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+
+
+class CacheRefreshStats(BaseModel):
+    refreshed: int = 0
+    skipped: int = 0  # Stale entries served without a refresh, retried later
+
+
+cache_backend = RedisCacheBackend()
+
+# One in-memory tier per namespace, shared by every function cached in it
+memory_caches: Dict[str, MemoryCacheBackend] = {}
+
+# One single-flight group per namespace
+single_flights: Dict[str, SingleFlight] = {}
+
+# Hit/miss counters per namespace and tier ("memory" or "redis")
+cache_stats: Dict[str, Dict[str, CacheTierStats]] = defaultdict(
+    lambda: defaultdict(CacheTierStats)
+)
+
+# Background refresh counters per namespace
+refresh_stats: Dict[str, CacheRefreshStats] = defaultdict(CacheRefreshStats)
+
+
+# Keys of the stale entries being refreshed, per namespace
+refreshing_keys: Dict[str, Set[str]] = defaultdict(set)
+
+# Keeps background refreshes referenced until they finish
+background_tasks = set()
+
+
+def create_background_task(coroutine) -> asyncio.Task:
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+def get_memory_cache(namespace: str) -> MemoryCacheBackend:
+    if namespace not in memory_caches:
+        memory_caches[namespace] = MemoryCacheBackend(
+            max_entries=cache_settings.local_max_entries,
+            max_bytes=cache_settings.local_max_bytes,
+        )
+
+    return memory_caches[namespace]
+
+
+def get_single_flight(namespace: str) -> SingleFlight:
+    if namespace not in single_flights:
+        single_flights[namespace] = SingleFlight(
+            namespace,
+            lock_ttl=cache_settings.single_flight_lock_ttl,
+            poll_interval=cache_settings.single_flight_poll_interval,
+        )
+
+    return single_flights[namespace]
+
+
+def record_cache_lookup(namespace: str, tier: str, is_hit: bool):
+    tier_stats = cache_stats[namespace][tier]
+    if is_hit:
+        tier_stats.hits += 1
+    else:
+        tier_stats.misses += 1
+
+
+def get_cache_stats() -> dict:
+    stats = {namespace: dict(tiers) for namespace, tiers in cache_stats.items()}
+
+    for namespace, memory_cache in memory_caches.items():
+        stats.setdefault(namespace, {})["memory_usage"] = {
+            "entries": len(memory_cache),
+            "size_bytes": memory_cache.size_bytes,
+            "evictions": memory_cache.evictions,
+        }
+
+    for namespace, single_flight in single_flights.items():
+        stats.setdefault(namespace, {})["single_flight"] = single_flight.stats
+
+    for namespace, namespace_refresh_stats in refresh_stats.items():
+        stats.setdefault(namespace, {})["refreshes"] = namespace_refresh_stats
+
+    return stats
+
+
+def cache_response(
+    ttl: int = 60,
+    namespace: str = "main",
+    local: bool = False,
+    policy: Optional[CachePolicy] = None,
+    is_negative: Optional[Callable[[Any], bool]] = None,
+    coalesce: bool = False,
+    can_refresh: Optional[Callable[[], Awaitable[bool]]] = None,
+    hints: Tuple[str, ...] = (),
+):
+    """
+    Caching decorator for async functions.
+
+    ttl: Time to live for the cache in seconds, when no policy is given.
     namespace: Namespace for cache keys in Redis.
+    local: Keep an in-memory LRU tier in front of Redis, for hot lookups.
+    policy: TTLs, stale window and jitter, see `CachePolicy`.
+    is_negative: Tells whether a result should use the policy's negative TTL.
+    coalesce: Make concurrent misses for the same call, in this worker or any
+        other, wait for a single call instead of each calling the function.
+        Only the caller that made the call stores its result.
+    can_refresh: Tells whether a stale result may be refreshed now, e.g. only
+        while the upstream has quota to spare.
+    hints: Arguments that may help compute a result but don't change which
+        result is right, e.g. a barcode next to the names it belongs to. They
+        are left out of cache keys, so calls with and without them share one
+        cached result.
+
+    Results are stored next to the times they stop being fresh and expire.
+    Stale results are returned right away and refreshed in the background,
+    with at most `CACHE_MAX_REFRESHES` refreshes per namespace in flight and
+    `background_requests` set. Stale results that can't be refreshed now are
+    refreshed on a later lookup.
+    Results read from Redis are kept in memory no longer than they have left
+    in Redis, so negative results are never served past their lifetime.
+    Exceptions are never cached.
+
+    The decorated function also gets `get_many` and `set_many`, which read and
+    write the cached results of many calls at once (each call given as a tuple
+    of positional arguments), `get_freshness_many`, which tells when those
+    results stop being fresh and whether they are negative, `compute`, which
+    calls the function without reading or writing the cache but still
+    coalesces, and `__wrapped__`, the uncached function.
     """
+    policy = policy or CachePolicy(ttl=ttl)
 
     def decorator(func):
+        memory_cache = get_memory_cache(namespace) if local else None
+        single_flight = get_single_flight(namespace) if coalesce else None
+        namespace_refreshing_keys = refreshing_keys[namespace]
+        namespace_refresh_stats = refresh_stats[namespace]
+
+        async def compute(*args, **kwargs) -> Any:
+            if single_flight is None:
+                return await func(*args, **kwargs)
+
+            return await single_flight.do(
+                make_cache_key(namespace, func, args, kwargs, hints),
+                lambda: func(*args, **kwargs),
+            )
+
+        def make_entry(value: Any) -> Tuple[list, int]:
+            fresh_ttl, expire_ttl = policy.lifetimes(
+                bool(is_negative and is_negative(value))
+            )
+            now = time.time()
+            return [value, now + fresh_ttl, now + expire_ttl], expire_ttl
+
+        def store_locally(cache_key: str, entry: list, expire_ttl: float):
+            expire_ttl = min(expire_ttl, cache_settings.local_ttl)
+            if memory_cache is not None and expire_ttl > 0:
+                memory_cache.set(cache_key, entry, ttl=expire_ttl)
+
+        def remaining_lifetime(entry: list) -> float:
+            # Entries cached before their expiry was stored only know when
+            # they stop being fresh
+            expires_at = entry[2] if len(entry) > 2 else entry[1]
+            return expires_at - time.time()
+
+        async def store(cache_key: str, value: Any):
+            entry, expire_ttl = make_entry(value)
+
+            await cache_backend.set(cache_key, entry, ttl=expire_ttl)
+            store_locally(cache_key, entry, expire_ttl)
+
+        async def compute_and_store(cache_key: str, args: tuple, kwargs: dict) -> Any:
+            async def call_and_store() -> Any:
+                value = await func(*args, **kwargs)
+                await store(cache_key, value)
+                return value
+
+            # Coalesced callers get the value the leader already stored
+            if single_flight is None:
+                return await call_and_store()
+
+            return await single_flight.do(cache_key, call_and_store)
+
+        async def refresh(cache_key: str, args: tuple, kwargs: dict):
+            # Upstream calls of the refresh count as background work
+            background_requests.set(True)
+
+            try:
+                if can_refresh is not None and not await can_refresh():
+                    namespace_refresh_stats.skipped += 1
+                    return
+
+                await compute_and_store(cache_key, args, kwargs)
+                namespace_refresh_stats.refreshed += 1
+            except Exception as e:
+                print(f"Error refreshing {cache_key}: {str(e)}")
+            finally:
+                namespace_refreshing_keys.discard(cache_key)
+
+        def use_entry(cache_key: str, entry: list, args: tuple, kwargs: dict) -> Any:
+            value, fresh_until = entry[0], entry[1]
+
+            if (
+                fresh_until <= time.time()
+                and cache_key not in namespace_refreshing_keys
+            ):
+                if len(namespace_refreshing_keys) >= cache_settings.max_refreshes:
+                    namespace_refresh_stats.skipped += 1
+                else:
+                    namespace_refreshing_keys.add(cache_key)
+                    create_background_task(refresh(cache_key, args, kwargs))
+
+            return value
+
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            input_key = [str(arg) for arg in args]
-            cache_key = f"{namespace}:{input_key}"
+            cache_key = make_cache_key(namespace, func, args, kwargs, hints)
 
-            cache = Cache.REDIS(
-                endpoint=redis_settings.host,
-                port=redis_settings.port,
-                namespace=namespace,
-            )
+            if memory_cache is not None:
+                is_cached, entry = memory_cache.get(cache_key)
+                record_cache_lookup(namespace, "memory", is_cached)
+                if is_cached:
+                    return use_entry(cache_key, entry, args, kwargs)
 
             # Try to retrieve data from cache
-            cached_value = await cache.get(cache_key)
-            if cached_value:
-                return json.loads(cached_value)  # Return cached data
+            is_cached, entry = await cache_backend.get(cache_key)
+            record_cache_lookup(namespace, "redis", is_cached)
+            if is_cached:
+                store_locally(cache_key, entry, remaining_lifetime(entry))
+                return use_entry(cache_key, entry, args, kwargs)
 
             # Call the actual function if cache is not hit
-            response = await func(*args, **kwargs)
+            return await compute_and_store(cache_key, args, kwargs)
 
-            try:
-                # Store the response in Redis with a TTL
-                await cache.set(cache_key, json.dumps(response), ttl=ttl)
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Error caching data: {e}")
+        async def get_many(calls: List[tuple]) -> List[Tuple[bool, Any]]:
+            cache_keys = [
+                make_cache_key(namespace, func, call, {}, hints) for call in calls
+            ]
+            entries: List[Tuple[bool, Any]] = [(False, None)] * len(calls)
+
+            redis_positions = []
+            for position, cache_key in enumerate(cache_keys):
+                if memory_cache is not None:
+                    entries[position] = memory_cache.get(cache_key)
+                    record_cache_lookup(namespace, "memory", entries[position][0])
+                if not entries[position][0]:
+                    redis_positions.append(position)
+
+            redis_entries = await cache_backend.get_many(
+                [cache_keys[position] for position in redis_positions]
+            )
+            for position, (is_cached, entry) in zip(redis_positions, redis_entries):
+                record_cache_lookup(namespace, "redis", is_cached)
+                if is_cached:
+                    entries[position] = (True, entry)
+                    store_locally(
+                        cache_keys[position], entry, remaining_lifetime(entry)
+                    )
+
+            return [
+                (True, use_entry(cache_key, entry, call, {}))
+                if is_cached
+                else (False, None)
+                for call, cache_key, (is_cached, entry) in zip(
+                    calls, cache_keys, entries
+                )
+            ]
+
+        async def get_freshness_many(
+            calls: List[tuple],
+        ) -> List[Optional[Tuple[float, bool]]]:
+            """
+            Returns when the shared cached result of each call stops being
+            fresh and whether it is negative, or None if it isn't cached.
+            Stale results aren't refreshed and the lookups aren't counted in
+            the cache stats.
+            """
+            entries = await cache_backend.get_many(
+                [make_cache_key(namespace, func, call, {}, hints) for call in calls]
+            )
+
+            return [
+                (entry[1], bool(is_negative and is_negative(entry[0])))
+                if is_cached
+                else None
+                for is_cached, entry in entries
+            ]
+
+        async def set_many(items: List[Tuple[tuple, Any]]):
+            cached_items = []
+            for call, value in items:
+                cache_key = make_cache_key(namespace, func, call, {}, hints)
+                entry, expire_ttl = make_entry(value)
+
+                cached_items.append((cache_key, entry, expire_ttl))
+                store_locally(cache_key, entry, expire_ttl)
+
+            await cache_backend.set_many(cached_items)
 
-            return response
+        wrapper.get_many = get_many
+        wrapper.set_many = set_many
+        wrapper.get_freshness_many = get_freshness_many
+        wrapper.compute = compute
 
         return wrapper
 
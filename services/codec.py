@@ -0,0 +1,38 @@
+from decimal import Decimal
+from typing import Any
+import msgpack
+
+TUPLE_EXT_TYPE = 1
+DECIMAL_EXT_TYPE = 2
+
+
+def _encode_extra_types(obj: Any) -> msgpack.ExtType:
+    if isinstance(obj, tuple):
+        return msgpack.ExtType(TUPLE_EXT_TYPE, serialize(list(obj)))
+
+    if isinstance(obj, Decimal):
+        return msgpack.ExtType(DECIMAL_EXT_TYPE, str(obj).encode("utf-8"))
+
+    raise TypeError(f"Cannot serialize {type(obj).__name__} for the cache")
+
+
+def _decode_extra_types(code: int, data: bytes) -> Any:
+    if code == TUPLE_EXT_TYPE:
+        return tuple(deserialize(data))
+
+    if code == DECIMAL_EXT_TYPE:
+        return Decimal(data.decode("utf-8"))
+
+    return msgpack.ExtType(code, data)
+
+
+def serialize(value: Any) -> bytes:
+    """
+    Packs a value with msgpack. Tuples and Decimals are stored as extension
+    types so they come back as tuples and Decimals instead of lists and floats.
+    """
+    return msgpack.packb(value, default=_encode_extra_types, strict_types=True)
+
+
+def deserialize(data: bytes) -> Any:
+    return msgpack.unpackb(data, ext_hook=_decode_extra_types)
@@ -0,0 +1,57 @@
+from typing import Optional
+from httpx import AsyncClient, Limits, Timeout
+from pydantic_settings import BaseSettings
+
+
+class HttpClientSettings(BaseSettings):
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    http2: bool = True
+    timeout: float = 10.0
+    connect_timeout: float = 5.0
+
+    class Config:
+        env_prefix = "HTTP_CLIENT_"
+
+
+http_client_settings = HttpClientSettings()
+
+_client: Optional[AsyncClient] = None
+
+
+def create_http_client() -> AsyncClient:
+    return AsyncClient(
+        http2=http_client_settings.http2,
+        limits=Limits(
+            max_connections=http_client_settings.max_connections,
+            max_keepalive_connections=http_client_settings.max_keepalive_connections,
+            keepalive_expiry=http_client_settings.keepalive_expiry,
+        ),
+        timeout=Timeout(
+            http_client_settings.timeout,
+            connect=http_client_settings.connect_timeout,
+        ),
+    )
+
+
+def get_http_client() -> AsyncClient:
+    """
+    Returns the pooled client shared by every gateway, so upstream connections
+    are kept alive across requests instead of being opened for each call.
+    It is normally created by the app lifespan, and lazily otherwise.
+    """
+    global _client
+
+    if _client is None or _client.is_closed:
+        _client = create_http_client()
+
+    return _client
+
+
+async def close_http_client():
+    global _client
+
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,86 @@
+import json
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from pydantic_settings import BaseSettings
+from starlette.websockets import WebSocket
+
+from services.request_timing import request_timings, timed_phase
+
+
+class JsonSettings(BaseSettings):
+    fast_encoder: bool = False
+
+    class Config:
+        env_prefix = "JSON_"
+
+
+json_settings = JsonSettings()
+
+
+def _encode_default(value: Any) -> Any:
+    # Same renderings as FastAPI's encoder: Decimal as a string, models as dicts
+    if isinstance(value, Decimal):
+        return str(value)
+
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json", by_alias=True)
+
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(value: Any) -> bytes:
+    """
+    Encodes `value` as compact UTF-8 JSON. Pydantic models are serialized by
+    pydantic-core directly, everything else by orjson.
+    """
+    if isinstance(value, BaseModel):
+        return value.__pydantic_serializer__.to_json(value, by_alias=True)
+
+    return orjson.dumps(value, default=_encode_default)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def json_response(content: Any) -> Any:
+    """
+    Wraps a route's return value in a pre-serialized response when
+    `JSON_FAST_ENCODER` is set, skipping FastAPI's jsonable_encoder pass.
+    Otherwise the value is returned as is, for FastAPI to encode, unless the
+    request is timed: then it is encoded here as FastAPI would, so the time
+    shows up in the `serialize` phase.
+    """
+    if isinstance(content, Response):
+        return content
+
+    if json_settings.fast_encoder:
+        with timed_phase("serialize"):
+            return FastJSONResponse(content)
+
+    if request_timings.get() is not None:
+        with timed_phase("serialize"):
+            return JSONResponse(jsonable_encoder(content))
+
+    return content
+
+
+def encode_text(data: Any) -> str:
+    """
+    Encodes `data` with the same output as `websocket.send_json`.
+    """
+    if not json_settings.fast_encoder:
+        return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+    return dumps(data).decode()
+
+
+async def send_json(websocket: WebSocket, data: Any):
+    await websocket.send_text(encode_text(data))
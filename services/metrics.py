@@ -0,0 +1,127 @@
+import time
+from contextlib import contextmanager
+from typing import Iterator
+from fastapi.responses import Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import CounterMetricFamily
+
+from services.request_timing import request_timings
+
+# From a Redis round trip on the same host to a slow Discogs search
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+upstream_request_duration = Histogram(
+    "upstream_request_duration_seconds",
+    "Duration of calls to Spotify, Discogs, Soketi and the Redis cache",
+    ["upstream", "call", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+
+rate_limit_wait = Histogram(
+    "rate_limit_wait_seconds",
+    "Time waited for a rate limiter slot before an upstream call",
+    ["limiter"],
+    buckets=(0.0, *LATENCY_BUCKETS, 60.0, 120.0),
+)
+
+albums_priced = Counter(
+    "albums_priced_total",
+    "Albums priced, from the price cache or by Discogs lookups",
+    ["source"],
+)
+
+websocket_valuations_in_progress = Gauge(
+    "websocket_valuations_in_progress",
+    "Library valuations streaming over a WebSocket",
+)
+
+
+class UpstreamCall:
+    __slots__ = ("status",)
+
+    def __init__(self):
+        self.status = "ok"
+
+
+@contextmanager
+def observe_upstream_call(upstream: str, call: str) -> Iterator[UpstreamCall]:
+    """
+    Times the call made in the block into `upstream_request_duration_seconds`,
+    and into the `{upstream}_{call}` phase of timed requests. The status is
+    "ok" unless the block sets the response's status code on the yielded
+    object, or "error" if it raises.
+    """
+    upstream_call = UpstreamCall()
+    started_at = time.perf_counter()
+
+    try:
+        yield upstream_call
+    except BaseException:
+        upstream_call.status = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - started_at
+        upstream_request_duration.labels(upstream, call, upstream_call.status).observe(
+            duration
+        )
+
+        timings = request_timings.get()
+        if timings is not None:
+            timings.add(f"{upstream}_{call}", duration)
+
+
+class CacheStatsCollector:
+    """
+    Exposes the hit and miss counters `cache_response` already keeps, read at
+    scrape time so cache lookups pay nothing extra.
+    """
+
+    def describe(self):
+        # Without it, registering would call `collect` while services.cache,
+        # which imports this module, is still loading
+        return []
+
+    def collect(self):
+        from services.cache import cache_stats
+
+        lookups = CounterMetricFamily(
+            "cache_lookups",
+            "Lookups of cached responses per namespace and tier",
+            labels=["namespace", "tier", "result"],
+        )
+
+        for namespace, tiers in list(cache_stats.items()):
+            for tier, tier_stats in list(tiers.items()):
+                lookups.add_metric([namespace, tier, "hit"], tier_stats.hits)
+                lookups.add_metric([namespace, tier, "miss"], tier_stats.misses)
+
+        yield lookups
+
+
+REGISTRY.register(CacheStatsCollector())
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
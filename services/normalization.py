@@ -0,0 +1,79 @@
+import re
+import unicodedata
+from typing import Dict, Tuple
+from pydantic import BaseModel
+
+# Words that mark a reissue or an edition of an album rather than a different album
+EDITION_WORDS = (
+    r"remaster(?:ed)?|deluxe|edition|expanded|anniversary|bonus|reissue|"
+    r"special|collector'?s|mono|stereo|explicit|clean"
+)
+
+# "X (Remastered 2011)", "X [Deluxe Edition]"
+EDITION_BRACKETS = re.compile(
+    rf"\s*[\(\[][^\)\]]*\b(?:{EDITION_WORDS})\b[^\)\]]*[\)\]]", re.IGNORECASE
+)
+
+# "X - 2009 Remaster", "X - Deluxe Edition"
+EDITION_SUFFIX = re.compile(rf"\s+-\s+[^-]*\b(?:{EDITION_WORDS})\b.*$", re.IGNORECASE)
+
+WHITESPACE = re.compile(r"\s+")
+
+# Normalized lookups remembered to tell which ones were merged with another
+# spelling; further lookups are still normalized but no longer counted
+MAX_TRACKED_LOOKUPS = 100000
+
+
+class NormalizationStats(BaseModel):
+    lookups: int = 0
+    rewritten: int = 0  # Lookups whose artist or album name was changed
+    merged: int = 0  # Lookups that now share a cache key with another spelling
+
+
+normalization_stats = NormalizationStats()
+
+_first_spelling: Dict[Tuple[str, str], Tuple[str, str]] = {}
+
+
+def _canonicalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return WHITESPACE.sub(" ", text).strip()
+
+
+def normalize_artist(artist: str) -> str:
+    return _canonicalize(artist)
+
+
+def normalize_album_name(album_name: str) -> str:
+    """
+    Drops edition and remaster markers from an album name, falling back to the
+    full name if nothing else would be left.
+    """
+    stripped_name = EDITION_SUFFIX.sub("", EDITION_BRACKETS.sub("", album_name))
+
+    return _canonicalize(stripped_name) or _canonicalize(album_name)
+
+
+def normalize_album_lookup(artist: str, album_name: str) -> Tuple[str, str]:
+    """
+    Returns the canonical (artist, album_name) pair used for cache keys and
+    Discogs searches, so editions of the same album share one lookup.
+    """
+    lookup = normalize_artist(artist), normalize_album_name(album_name)
+
+    normalization_stats.lookups += 1
+    if lookup != (artist, album_name):
+        normalization_stats.rewritten += 1
+
+    first_spelling = _first_spelling.get(lookup)
+    if first_spelling is None:
+        if len(_first_spelling) < MAX_TRACKED_LOOKUPS:
+            _first_spelling[lookup] = (artist, album_name)
+    elif first_spelling != (artist, album_name):
+        normalization_stats.merged += 1
+
+    return lookup
+
+
+def build_search_query(artist: str, album_name: str) -> str:
+    return f"{artist} - {album_name} CD"
@@ -0,0 +1,237 @@
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Mapping, Optional
+from pydantic import BaseModel
+from redis.exceptions import RedisError
+
+from services.metrics import rate_limit_wait
+from services.redis_client import get_redis
+from services.request_timing import record_phase
+
+# Refills the bucket from the time elapsed since the last call and takes one
+# token. Tokens may go negative: each caller reserves its slot and is told how
+# long to wait for it, so waiters are served in order without polling.
+ACQUIRE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local max_wait = tonumber(ARGV[3])
+
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1]) or capacity
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+
+local wait = 0
+if tokens < 1 then
+    wait = (1 - tokens) / rate
+end
+
+if wait > max_wait then
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+    return '-1'
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens - 1, 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate + max_wait) + 60)
+return tostring(wait)
+"""
+
+# Lowers the bucket to the budget the upstream reports as remaining, so every
+# worker backs off as soon as one of them sees the quota running out.
+SYNC_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local remaining = tonumber(ARGV[3])
+
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1]) or capacity
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+
+redis.call('HSET', KEYS[1], 'tokens', math.min(tokens, remaining), 'updated_at', now)
+return 1
+"""
+
+
+# Refills the bucket like ACQUIRE_SCRIPT but only reports the tokens left,
+# without taking one
+PEEK_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1]) or capacity
+local updated_at = tonumber(state[2]) or now
+
+return tostring(math.min(capacity, tokens + math.max(0, now - updated_at) * rate))
+"""
+
+# Set while background work (e.g. cache warming) calls the upstream, so its
+# share of the quota can be told apart from interactive traffic
+background_requests: ContextVar[bool] = ContextVar("background_requests", default=False)
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+class RateLimiterStats(BaseModel):
+    acquired: int = 0
+    waits: int = 0
+    wait_seconds: float = 0.0
+    throttled: int = 0  # Acquisitions refused because the wait exceeded max_wait
+    rejections: int = 0  # 429 responses returned by the upstream
+    background_acquired: int = 0  # Acquisitions made for background work
+    shared: bool = True  # False while Redis is unreachable and the local bucket is used
+
+
+class LocalTokenBucket:
+    """
+    In-process version of the Redis bucket, used while Redis is unreachable so
+    each worker still paces itself.
+    """
+
+    def __init__(self, capacity: float):
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, rate: float, capacity: float):
+        now = time.monotonic()
+        self.tokens = min(capacity, self.tokens + (now - self.updated_at) * rate)
+        self.updated_at = now
+
+    def acquire(self, rate: float, capacity: float, max_wait: float) -> float:
+        self._refill(rate, capacity)
+
+        wait = (1 - self.tokens) / rate if self.tokens < 1 else 0.0
+        if wait > max_wait:
+            return -1.0
+
+        self.tokens -= 1
+        return wait
+
+    def sync(self, rate: float, capacity: float, remaining: float):
+        self._refill(rate, capacity)
+        self.tokens = min(self.tokens, remaining)
+
+    def peek(self, rate: float, capacity: float) -> float:
+        self._refill(rate, capacity)
+        return self.tokens
+
+
+class TokenBucketLimiter:
+    """
+    Token bucket shared by every worker through Redis.
+
+    `acquire` must be awaited before each upstream call and
+    `sync_from_headers` called with each response, so the bucket follows the
+    budget the upstream reports in its rate limit headers.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: int,
+        burst: int,
+        max_wait: float,
+        limit_header: str,
+        remaining_header: str,
+    ):
+        self.name = name
+        self.key = f"ratelimit:{name}"
+        self.rate = requests_per_minute / 60
+        self.capacity = burst
+        self.max_wait = max_wait
+        self.limit_header = limit_header
+        self.remaining_header = remaining_header
+        self.stats = RateLimiterStats()
+        self._wait_histogram = rate_limit_wait.labels(name)
+
+        self._local_bucket = LocalTokenBucket(burst)
+
+    async def acquire(self):
+        try:
+            wait = float(
+                await get_redis().eval(
+                    ACQUIRE_SCRIPT,
+                    1,
+                    self.key,
+                    self.rate,
+                    self.capacity,
+                    self.max_wait,
+                )
+            )
+            self.stats.shared = True
+        except RedisError:
+            wait = self._local_bucket.acquire(self.rate, self.capacity, self.max_wait)
+            self.stats.shared = False
+
+        if wait < 0:
+            self.stats.throttled += 1
+            raise RateLimitExceeded(
+                f"Rate limit for {self.key} would need a wait above {self.max_wait}s"
+            )
+
+        self.stats.acquired += 1
+        if background_requests.get():
+            self.stats.background_acquired += 1
+
+        self._wait_histogram.observe(wait)
+
+        if wait > 0:
+            self.stats.waits += 1
+            self.stats.wait_seconds += wait
+            record_phase(f"{self.name}_rate_limit_wait", wait)
+            await asyncio.sleep(wait)
+
+    async def available_tokens(self) -> float:
+        """
+        Returns the tokens left in the bucket, negative while callers are
+        waiting for their slot.
+        """
+        try:
+            return float(
+                await get_redis().eval(
+                    PEEK_SCRIPT, 1, self.key, self.rate, self.capacity
+                )
+            )
+        except RedisError:
+            return self._local_bucket.peek(self.rate, self.capacity)
+
+    async def sync_from_headers(self, headers: Mapping[str, str], status_code: int):
+        remaining = _header_as_int(headers, self.remaining_header)
+
+        if status_code == 429:
+            self.stats.rejections += 1
+            remaining = 0
+
+        limit = _header_as_int(headers, self.limit_header)
+        if limit:
+            self.rate = limit / 60
+
+        if remaining is None:
+            return
+
+        try:
+            await get_redis().eval(
+                SYNC_SCRIPT, 1, self.key, self.rate, self.capacity, remaining
+            )
+        except RedisError:
+            self._local_bucket.sync(self.rate, self.capacity, remaining)
+
+
+def _header_as_int(headers: Mapping[str, str], name: str) -> Optional[int]:
+    try:
+        return int(headers[name])
+    except (KeyError, ValueError):
+        return None
@@ -0,0 +1,47 @@
+from typing import Optional
+from pydantic_settings import BaseSettings
+from redis.asyncio import ConnectionPool, Redis
+
+
+class RedisSetting(BaseSettings):
+    port: int = 6379
+    host: str = "localhost"
+    max_connections: int = 50
+    socket_timeout: float = 1.0
+
+    class Config:
+        env_prefix = "REDIS_"
+
+
+redis_settings = RedisSetting()
+
+_redis: Optional[Redis] = None
+
+
+def get_redis() -> Redis:
+    """
+    Returns the Redis client shared by the whole process. Every caller borrows
+    connections from the same pool instead of opening its own.
+    """
+    global _redis
+
+    if _redis is None:
+        _redis = Redis(
+            connection_pool=ConnectionPool(
+                host=redis_settings.host,
+                port=redis_settings.port,
+                max_connections=redis_settings.max_connections,
+                socket_timeout=redis_settings.socket_timeout,
+                socket_connect_timeout=redis_settings.socket_timeout,
+            )
+        )
+
+    return _redis
+
+
+async def close_redis():
+    global _redis
+
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
@@ -0,0 +1,211 @@
+import argparse
+import gzip
+import os
+import re
+import sqlite3
+import xml.etree.ElementTree as ElementTree
+from typing import IO, Iterator, List, Optional, Tuple
+
+from services.normalization import normalize_album_name, normalize_artist
+
+# Discogs tells apart artists sharing a name with a suffix, e.g. "Nirvana (2)"
+ARTIST_DISAMBIGUATION = re.compile(r"\s+\(\d+\)$")
+
+INSERT_BATCH_SIZE = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS releases_by_name (
+    artist TEXT NOT NULL,
+    title TEXT NOT NULL,
+    release_id INTEGER NOT NULL,
+    is_cd INTEGER NOT NULL,
+    PRIMARY KEY (artist, title)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS releases_by_barcode (
+    barcode TEXT PRIMARY KEY,
+    release_id INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Prefers CD releases, then the oldest release id, for each artist and title
+INSERT_BY_NAME = """
+INSERT INTO releases_by_name (artist, title, release_id, is_cd)
+VALUES (?, ?, ?, ?)
+ON CONFLICT (artist, title) DO UPDATE SET
+    release_id = excluded.release_id,
+    is_cd = excluded.is_cd
+WHERE excluded.is_cd > releases_by_name.is_cd
+    OR (excluded.is_cd = releases_by_name.is_cd
+        AND excluded.release_id < releases_by_name.release_id)
+"""
+
+# A barcode printed on several releases keeps the oldest one
+INSERT_BY_BARCODE = """
+INSERT INTO releases_by_barcode (barcode, release_id) VALUES (?, ?)
+ON CONFLICT (barcode) DO UPDATE SET release_id = excluded.release_id
+WHERE excluded.release_id < releases_by_barcode.release_id
+"""
+
+
+def normalize_barcode(barcode: str) -> str:
+    """
+    Keeps the digits of a barcode without leading zeros, so a UPC-A and the
+    EAN-13 written for it, e.g. Spotify's "0602547..." and Discogs'
+    "6 02547 ...", are the same.
+    """
+    digits = "".join(character for character in barcode if character.isdigit())
+    return digits.lstrip("0")
+
+
+def _open_dump(dump_path: str) -> IO[bytes]:
+    if dump_path.endswith(".gz"):
+        return gzip.open(dump_path, "rb")
+
+    return open(dump_path, "rb")
+
+
+def iter_dump_releases(
+    dump: IO[bytes],
+) -> Iterator[Tuple[int, str, str, bool, List[str]]]:
+    """
+    Streams (release_id, artist, title, is_cd, barcodes) tuples from a releases
+    dump. Each release element is cleared once read, so memory use stays
+    constant however large the dump is.
+    """
+    events = ElementTree.iterparse(dump, events=("start", "end"))
+    _, root = next(events)
+
+    for event, element in events:
+        if event != "end" or element.tag != "release":
+            continue
+
+        artist = element.findtext("artists/artist/name")
+        title = element.findtext("title")
+
+        if artist and title and element.get("id"):
+            is_cd = any(
+                format_element.get("name") == "CD"
+                for format_element in element.iterfind("formats/format")
+            )
+            barcodes = [
+                identifier.get("value", "")
+                for identifier in element.iterfind("identifiers/identifier")
+                if identifier.get("type") == "Barcode"
+            ]
+
+            yield int(element.get("id")), artist, title, is_cd, barcodes
+
+        element.clear()
+        root.clear()
+
+
+def import_releases_dump(dump: IO[bytes], index_path: str) -> int:
+    """
+    Builds the index at `index_path` from a releases dump and returns how many
+    releases were indexed. The index is written next to its final path and
+    moved into place at the end, so readers never see a partial index.
+    """
+    partial_path = f"{index_path}.partial"
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+
+    connection = sqlite3.connect(partial_path)
+    connection.executescript(
+        "PRAGMA journal_mode = OFF; PRAGMA synchronous = OFF;" + SCHEMA
+    )
+
+    indexed_releases = 0
+    rows_by_name = []
+    rows_by_barcode = []
+
+    def flush():
+        connection.executemany(INSERT_BY_NAME, rows_by_name)
+        connection.executemany(INSERT_BY_BARCODE, rows_by_barcode)
+        rows_by_name.clear()
+        rows_by_barcode.clear()
+
+    for release_id, artist, title, is_cd, barcodes in iter_dump_releases(dump):
+        artist = normalize_artist(ARTIST_DISAMBIGUATION.sub("", artist))
+        rows_by_name.append((artist, normalize_album_name(title), release_id, is_cd))
+
+        for barcode in map(normalize_barcode, barcodes):
+            if barcode:
+                rows_by_barcode.append((barcode, release_id))
+
+        indexed_releases += 1
+        if len(rows_by_name) >= INSERT_BATCH_SIZE:
+            flush()
+
+    flush()
+    connection.commit()
+    connection.close()
+
+    os.replace(partial_path, index_path)
+
+    return indexed_releases
+
+
+class ReleaseIndex:
+    """
+    Read-only view of an index built by `import_releases_dump`. Lookups are
+    primary key reads on a local file, cheap enough to run on the event loop.
+    """
+
+    def __init__(self, index_path: str):
+        self.connection = sqlite3.connect(
+            f"file:{index_path}?mode=ro", uri=True, check_same_thread=False
+        )
+
+    def lookup(self, artist: str, album_name: str) -> Optional[int]:
+        """
+        Returns the release indexed for an artist and album name already
+        normalized with `normalize_album_lookup`, or None.
+        """
+        row = self.connection.execute(
+            "SELECT release_id FROM releases_by_name WHERE artist = ? AND title = ?",
+            (artist, album_name),
+        ).fetchone()
+
+        return row[0] if row else None
+
+    def lookup_barcode(self, barcode: str) -> Optional[int]:
+        """
+        Returns the release printed with a barcode, e.g. an album's UPC, or
+        None.
+        """
+        barcode = normalize_barcode(barcode)
+        if not barcode:
+            return None
+
+        row = self.connection.execute(
+            "SELECT release_id FROM releases_by_barcode WHERE barcode = ?",
+            (barcode,),
+        ).fetchone()
+
+        return row[0] if row else None
+
+
+def open_release_index(index_path: Optional[str]) -> Optional[ReleaseIndex]:
+    if not index_path or not os.path.exists(index_path):
+        return None
+
+    return ReleaseIndex(index_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the local Discogs release index from a releases dump."
+    )
+    parser.add_argument("dump_path", help="Discogs releases dump (.xml or .xml.gz)")
+    parser.add_argument("index_path", help="Where to write the SQLite index")
+    args = parser.parse_args()
+
+    with _open_dump(args.dump_path) as dump:
+        indexed_releases = import_releases_dump(dump, args.index_path)
+
+    print(f"Indexed {indexed_releases} releases into {args.index_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+from pydantic_settings import BaseSettings
+
+
+class RequestTimingSettings(BaseSettings):
+    enabled: bool = True  # Whether clients may ask for a timing breakdown
+
+    class Config:
+        env_prefix = "REQUEST_TIMING_"
+
+
+request_timing_settings = RequestTimingSettings()
+
+# Requests opt in with this header or with `?timing=true`
+TIMING_HEADER = b"x-request-timing"
+
+
+class RequestTimings:
+    """
+    Time spent per phase of a request, e.g. `spotify_saved_albums` or
+    `discogs_search`. Tasks started by the request share it, so phases run
+    concurrently add up to more than the request's wall time.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases: Dict[str, List[float]] = {}  # name: [seconds, count]
+
+    def add(self, phase: str, seconds: float):
+        totals = self.phases.get(phase)
+        if totals is None:
+            self.phases[phase] = [seconds, 1]
+        else:
+            totals[0] += seconds
+            totals[1] += 1
+
+    def server_timing(self) -> str:
+        entries = [
+            f'{phase};dur={seconds * 1000:.1f};desc="calls={count}"'
+            for phase, (seconds, count) in self.phases.items()
+        ]
+        entries.append(
+            f"total;dur={(time.perf_counter() - self.started_at) * 1000:.1f}"
+        )
+
+        return ", ".join(entries)
+
+    def summary(self) -> dict:
+        return {
+            "type": "timing",
+            "total_ms": (time.perf_counter() - self.started_at) * 1000,
+            "phases": {
+                phase: {"duration_ms": seconds * 1000, "count": count}
+                for phase, (seconds, count) in self.phases.items()
+            },
+        }
+
+
+# Set only for the requests that asked for a timing breakdown
+request_timings: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "request_timings", default=None
+)
+
+_not_timed = nullcontext()
+
+
+class _TimedPhase:
+    __slots__ = ("timings", "phase", "started_at")
+
+    def __init__(self, timings: RequestTimings, phase: str):
+        self.timings = timings
+        self.phase = phase
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.timings.add(self.phase, time.perf_counter() - self.started_at)
+
+
+def timed_phase(phase: str):
+    """
+    Context manager adding the time spent in the block to `phase`, if the
+    current request is timed. Otherwise it does nothing.
+    """
+    timings = request_timings.get()
+    if timings is None:
+        return _not_timed
+
+    return _TimedPhase(timings, phase)
+
+
+def record_phase(phase: str, seconds: float):
+    timings = request_timings.get()
+    if timings is not None:
+        timings.add(phase, seconds)
+
+
+def get_timing_summary() -> Optional[dict]:
+    """
+    Returns the timing frame of the current request, or None if it isn't
+    timed.
+    """
+    timings = request_timings.get()
+    return None if timings is None else timings.summary()
+
+
+def _is_timing_requested(scope: dict) -> bool:
+    for name, value in scope["headers"]:
+        if name == TIMING_HEADER:
+            return value.decode().lower() in ("1", "true")
+
+    query_string = scope.get("query_string", b"")
+    if b"timing" not in query_string:
+        return False
+
+    values = parse_qs(query_string.decode()).get("timing", [""])
+    return values[-1].lower() in ("1", "true")
+
+
+class RequestTimingMiddleware:
+    """
+    Times the requests and WebSocket sessions that ask for it, with the
+    `X-Request-Timing: true` header or `?timing=true`. HTTP responses get a
+    `Server-Timing` header; WebSocket handlers send `get_timing_summary()`.
+    Other requests only pay for the opt-in check.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket") or not _is_timing_requested(
+            scope
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+
+        async def send_with_server_timing(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"server-timing", timings.server_timing().encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(
+                scope,
+                receive,
+                send_with_server_timing if scope["type"] == "http" else send,
+            )
+        finally:
+            request_timings.reset(token)
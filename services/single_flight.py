@@ -0,0 +1,189 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from uuid import uuid4
+from pydantic import BaseModel
+from redis.exceptions import RedisError
+
+from services.codec import deserialize, serialize
+from services.redis_client import get_redis
+
+# Deletes the lock only if it is still ours, so a leader whose lock expired
+# can't release the lock of the worker that took over
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Pushes back the lock's expiry only if it is still ours
+EXTEND_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class SingleFlightStats(BaseModel):
+    leaders: int = 0  # Calls that went upstream
+    coalesced: int = 0  # Calls that waited for a call in flight in this worker
+    remote_waits: int = 0  # Calls that waited for a call in flight in another worker
+    remote_hits: int = 0  # Remote waits that got the other worker's result
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one upstream call.
+
+    Within a worker, callers share the future of the call in flight. Across
+    workers, the caller that takes a short Redis lock makes the call and
+    publishes its result next to the lock, and the others poll for it. The
+    leader keeps extending its lock while the call runs, however long it waits
+    for a rate limiter slot. If the leader fails or dies and its lock goes,
+    waiters race for the lock again, so only one of them makes the call.
+    """
+
+    def __init__(self, namespace: str, lock_ttl: float, poll_interval: float):
+        self.namespace = namespace
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self.stats = SingleFlightStats()
+
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._in_flight.get(key)
+
+        if future is not None:
+            self.stats.coalesced += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # The leader was cancelled, not us, so take over
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                return await self.do(key, compute)
+
+        future = asyncio.get_running_loop().create_future()
+        # Nobody may be waiting, don't report the exception as never retrieved
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._in_flight[key] = future
+
+        try:
+            value = await self._do_across_workers(key, compute)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            del self._in_flight[key]
+
+    async def _do_across_workers(
+        self, key: str, compute: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        lock_key = f"singleflight:{key}"
+        result_key = f"{lock_key}:result"
+        token = uuid4().hex
+
+        while True:
+            try:
+                is_leader = await get_redis().set(
+                    lock_key, token, nx=True, px=int(self.lock_ttl * 1000)
+                )
+            except RedisError:
+                # Without Redis, only coalesce within this worker
+                return await compute()
+
+            if is_leader:
+                break
+
+            self.stats.remote_waits += 1
+
+            is_published, value = await self._wait_for_leader(lock_key, result_key)
+            if is_published:
+                self.stats.remote_hits += 1
+                return value
+
+            if is_published is None:
+                # Redis went away while waiting
+                return await compute()
+
+        self.stats.leaders += 1
+        keep_locked = asyncio.create_task(self._keep_locked(lock_key, token))
+
+        try:
+            value = await compute()
+        except BaseException:
+            keep_locked.cancel()
+            await self._release(lock_key, token)
+            raise
+
+        keep_locked.cancel()
+
+        await self._release(lock_key, token, result_key, value)
+        return value
+
+    async def _keep_locked(self, lock_key: str, token: str):
+        while True:
+            await asyncio.sleep(self.lock_ttl / 3)
+
+            try:
+                await get_redis().eval(
+                    EXTEND_SCRIPT, 1, lock_key, token, int(self.lock_ttl * 1000)
+                )
+            except RedisError as e:
+                print(f"Error extending {lock_key}: {str(e)}")
+
+    async def _wait_for_leader(
+        self, lock_key: str, result_key: str
+    ) -> Tuple[Optional[bool], Any]:
+        """
+        Polls until the leader publishes its result or its lock goes. Returns
+        (True, value) once published, (False, None) if the lock went without a
+        result, and (None, None) if Redis can't be reached.
+        """
+        while True:
+            await asyncio.sleep(self.poll_interval)
+
+            # The leader publishes before it unlocks, so checking the lock first
+            # can't miss a result published in between
+            try:
+                async with get_redis().pipeline(transaction=False) as pipeline:
+                    pipeline.exists(lock_key)
+                    pipeline.get(result_key)
+                    is_locked, published_value = await pipeline.execute()
+            except RedisError:
+                return None, None
+
+            if published_value is not None:
+                return True, deserialize(published_value)
+
+            if not is_locked:
+                return False, None
+
+    async def _release(
+        self,
+        lock_key: str,
+        token: str,
+        result_key: str | None = None,
+        value: Any = None,
+    ):
+        try:
+            async with get_redis().pipeline(transaction=False) as pipeline:
+                if result_key is not None:
+                    # Only needs to outlive the next poll of the waiters
+                    pipeline.set(
+                        result_key,
+                        serialize(value),
+                        px=int(max(self.poll_interval * 4, 1) * 1000),
+                    )
+                pipeline.eval(RELEASE_SCRIPT, 1, lock_key, token)
+                await pipeline.execute()
+        except (RedisError, TypeError, ValueError) as e:
+            print(f"Error releasing {lock_key}: {str(e)}")
@@ -0,0 +1,9 @@
+import hashlib
+
+
+def hash_access_token(access_token: str) -> str:
+    """
+    Stable identifier of an access token, for Redis keys and ownership checks
+    that must not store the token itself.
+    """
+    return hashlib.sha256(access_token.encode()).hexdigest()
@@ -0,0 +1,129 @@
+from typing import Dict, Optional
+from uuid import uuid4
+from pydantic_settings import BaseSettings
+from redis.exceptions import RedisError
+
+from services.codec import deserialize, serialize
+from services.redis_client import get_redis
+from services.tokens import hash_access_token
+
+
+class ValuationSessionSettings(BaseSettings):
+    ttl: int = 86400
+
+    class Config:
+        env_prefix = "VALUATION_SESSION_"
+
+
+valuation_session_settings = ValuationSessionSettings()
+
+
+class ValuationSession:
+    """
+    Progress of a WebSocket valuation, kept in Redis so a client that
+    reconnects with the session id gets the finished results replayed and the
+    valuation continues from the first unfinished album.
+
+    The session is a hash with its owner, total and completion, next to a hash
+    of finished album messages by index. Both expire `VALUATION_SESSION_TTL`
+    seconds after the last write. Redis errors are reported and the valuation
+    carries on without being resumable.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        owner: str,
+        total: Optional[int] = None,
+        is_complete: bool = False,
+        results: Optional[Dict[int, dict]] = None,
+    ):
+        self.session_id = session_id
+        self.owner = owner
+        self.total = total
+        self.is_complete = is_complete
+        self.results: Dict[int, dict] = results or {}
+
+    @property
+    def key(self) -> str:
+        return f"valuation:{self.session_id}"
+
+    @property
+    def results_key(self) -> str:
+        return f"{self.key}:results"
+
+    def first_unfinished_index(self) -> int:
+        index = 1
+        while index in self.results:
+            index += 1
+
+        return index
+
+    async def save_total(self, total: int):
+        self.total = total
+        await self._write({"owner": self.owner, "total": total})
+
+    async def save_results(self, messages: Dict[int, dict]):
+        """
+        Saves the finished album messages by index, in one write for all.
+        """
+        if not messages:
+            return
+
+        self.results.update(messages)
+        await self._write(
+            results={index: serialize(message) for index, message in messages.items()}
+        )
+
+    async def mark_complete(self):
+        self.is_complete = True
+        await self._write({"complete": 1})
+
+    async def _write(
+        self, fields: Optional[dict] = None, results: Optional[dict] = None
+    ):
+        ttl = valuation_session_settings.ttl
+
+        try:
+            async with get_redis().pipeline(transaction=False) as pipeline:
+                if fields:
+                    pipeline.hset(self.key, mapping=fields)
+                if results:
+                    pipeline.hset(self.results_key, mapping=results)
+                pipeline.expire(self.key, ttl)
+                pipeline.expire(self.results_key, ttl)
+                await pipeline.execute()
+        except (RedisError, TypeError, ValueError) as e:
+            print(f"Error saving valuation session {self.session_id}: {str(e)}")
+
+
+async def open_valuation_session(
+    access_token: str, session_id: Optional[str] = None
+) -> ValuationSession:
+    """
+    Loads the session `session_id` if it exists and was started with the same
+    access token, and starts a new session otherwise.
+    """
+    owner = hash_access_token(access_token)
+
+    if session_id:
+        session = ValuationSession(session_id, owner)
+
+        try:
+            async with get_redis().pipeline(transaction=False) as pipeline:
+                pipeline.hgetall(session.key)
+                pipeline.hgetall(session.results_key)
+                fields, results = await pipeline.execute()
+
+            if fields.get(b"owner", b"").decode() == owner:
+                session.total = int(fields[b"total"]) if b"total" in fields else None
+                session.is_complete = b"complete" in fields
+                session.results = {
+                    int(index): deserialize(message)
+                    for index, message in results.items()
+                }
+                return session
+        except (RedisError, ValueError) as e:
+            print(f"Error loading valuation session {session_id}: {str(e)}")
+
+    return ValuationSession(uuid4().hex, owner)
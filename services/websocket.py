@@ -1,6 +1,16 @@
-import pusher
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+from typing import Optional
+from urllib.parse import urlencode
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 
+from services.http_client import get_http_client
+from services.metrics import observe_upstream_call
+
 
 class SoketiSettings(BaseSettings):
     host: str = "localhost"
@@ -15,33 +25,80 @@ class SoketiSettings(BaseSettings):
         env_prefix = "SOKETI_DEFAULT_APP_"
 
 
+class EventPublisherSettings(BaseSettings):
+    batch_size: int = 10  # Events per batch trigger call, Pusher refuses more
+    linger: float = 0.1
+    max_pending_events: int = 1000
+    close_timeout: float = 2.0  # Seconds to send the buffered events on close
+
+    class Config:
+        env_prefix = "SOKETI_PUBLISHER_"
+
+
 soketi_settings = SoketiSettings()
+event_publisher_settings = EventPublisherSettings()
+
+
+def get_soketi_url() -> str:
+    scheme = "https" if soketi_settings.use_tls else "http"
+    return f"{scheme}://{soketi_settings.host}:{soketi_settings.port}"
 
 
-def get_pusher_client() -> pusher.Pusher:
+def _sign(value: str) -> str:
+    return hmac.new(
+        soketi_settings.secret.encode(), value.encode(), hashlib.sha256
+    ).hexdigest()
+
+
+async def _post(path: str, body: dict) -> dict:
     """
-    Get a Pusher client instance configured for Soketi.
+    Send a signed request to the Pusher HTTP API served by Soketi, through the
+    shared pooled client.
+
+    Args:
+        path: The API path, e.g. /apps/{app_id}/events.
+        body: The JSON body of the request.
 
     Returns:
-        pusher.Pusher: Configured Pusher client instance.
+        dict: Response from the Pusher API.
     """
-    return pusher.Pusher(
-        app_id=soketi_settings.app_id,
-        key=soketi_settings.key,
-        secret=soketi_settings.secret,
-        host=soketi_settings.host,
-        port=soketi_settings.port,
-        ssl=soketi_settings.use_tls,
-        cluster=soketi_settings.cluster,
+    content = json.dumps(body, separators=(",", ":")).encode()
+
+    params = {
+        "auth_key": soketi_settings.key,
+        "auth_timestamp": str(int(time.time())),
+        "auth_version": "1.0",
+        "body_md5": hashlib.md5(content).hexdigest(),
+    }
+    params["auth_signature"] = _sign(
+        f"POST\n{path}\n{urlencode(sorted(params.items()))}"
     )
-    
-client = get_pusher_client()
+
+    with observe_upstream_call("soketi", path.rsplit("/", 1)[-1]) as upstream_call:
+        response = await get_http_client().post(
+            f"{get_soketi_url()}{path}",
+            params=params,
+            content=content,
+            headers={"Content-Type": "application/json"},
+        )
+        upstream_call.status = response.status_code
+    response.raise_for_status()
+
+    return response.json()
+
+
+def _event_payload(
+    channel: str, event: str, data: dict, socket_id: str | None = None
+) -> dict:
+    payload = {"channel": channel, "name": event, "data": json.dumps(data)}
+    if socket_id:
+        payload["socket_id"] = socket_id
+
+    return payload
+
 
 async def trigger_event(
-    channel: str,
-    event: str,
-    data: dict,
-    socket_id: str | None = None
+    channel: str, event: str, data: dict, socket_id: str | None = None
 ) -> dict:
     """
     Trigger an event on a specific channel via Soketi.
@@ -55,8 +112,10 @@ async def trigger_event(
     Returns:
         dict: Response from the Pusher API.
     """
-    
-    return client.trigger(channel, event, data, socket_id)
+    payload = _event_payload(channel, event, data, socket_id)
+    payload["channels"] = [payload.pop("channel")]
+
+    return await _post(f"/apps/{soketi_settings.app_id}/events", payload)
 
 
 async def trigger_batch(events: list[dict]) -> dict:
@@ -73,14 +132,152 @@ async def trigger_batch(events: list[dict]) -> dict:
     Returns:
         dict: Response from the Pusher API.
     """
-    return client.trigger_batch(events)
+    batch = [
+        _event_payload(
+            event["channel"], event["name"], event["data"], event.get("socket_id")
+        )
+        for event in events
+    ]
+
+    return await _post(f"/apps/{soketi_settings.app_id}/batch_events", {"batch": batch})
+
+
+class EventPublisherStats(BaseModel):
+    published: int = 0
+    requests: int = 0
+    failed_events: int = 0
+    backpressure_waits: int = 0  # Publishes that waited for room in the buffer
+
+
+class EventPublisher:
+    """
+    Buffers events and sends them with the batch trigger API from a background
+    task, so publishing never waits for Soketi on the hot path.
+
+    A batch is sent once it holds `batch_size` events, or `linger` seconds
+    after its first event. Batches are sent one at a time; when Soketi is slow
+    the buffer fills up, and once it holds `max_pending_events` events
+    `publish` waits for room instead of buffering more. Failed batches are
+    reported and dropped, progress events are not worth retrying. On close,
+    events still buffered after `close_timeout` seconds are dropped too.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = event_publisher_settings.batch_size,
+        linger: float = event_publisher_settings.linger,
+        max_pending_events: int = event_publisher_settings.max_pending_events,
+        close_timeout: float = event_publisher_settings.close_timeout,
+    ):
+        self.batch_size = batch_size
+        self.linger = linger
+        self.close_timeout = close_timeout
+        self.stats = EventPublisherStats()
+
+        self._queue: asyncio.Queue = asyncio.Queue(max_pending_events)
+        self._sender: Optional[asyncio.Task] = None
+
+    async def publish(
+        self, channel: str, event: str, data: dict, socket_id: str | None = None
+    ):
+        """
+        Queue an event to be sent with the next batch.
+
+        Args:
+            channel: The channel name to trigger the event on.
+            event: The event name to trigger.
+            data: The data payload to send with the event.
+            socket_id: Optional socket ID to exclude from receiving the event.
+        """
+        if self._sender is None or self._sender.done():
+            self._sender = asyncio.create_task(self._send_batches())
+
+        event_payload = {"channel": channel, "name": event, "data": data}
+        if socket_id:
+            event_payload["socket_id"] = socket_id
+
+        if self._queue.full():
+            self.stats.backpressure_waits += 1
+
+        await self._queue.put(event_payload)
+        self.stats.published += 1
+
+    async def flush(self):
+        """
+        Wait until every queued event has been sent.
+        """
+        if self._sender is not None and not self._sender.done():
+            await self._queue.join()
+
+    async def close(self):
+        """
+        Sends the buffered events, giving up after `close_timeout` seconds so
+        an unreachable Soketi can't hold up shutdown.
+        """
+        try:
+            await asyncio.wait_for(self.flush(), self.close_timeout)
+        except TimeoutError:
+            dropped_events = self._queue.qsize()
+            self.stats.failed_events += dropped_events
+            print(f"Dropped {dropped_events} events still buffered on close")
+
+        if self._sender is not None:
+            self._sender.cancel()
+            await asyncio.gather(self._sender, return_exceptions=True)
+            self._sender = None
+
+    async def _send_batches(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.monotonic() + self.linger
+
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except TimeoutError:
+                    break
+
+            try:
+                self.stats.requests += 1
+                await trigger_batch(batch)
+            except asyncio.CancelledError:
+                self.stats.failed_events += len(batch)
+                raise
+            except Exception as e:
+                self.stats.failed_events += len(batch)
+                print(f"Error publishing {len(batch)} events: {str(e)}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+_publisher: Optional[EventPublisher] = None
+
+
+def get_event_publisher() -> EventPublisher:
+    global _publisher
+
+    if _publisher is None:
+        _publisher = EventPublisher()
+
+    return _publisher
+
+
+async def close_event_publisher():
+    global _publisher
+
+    if _publisher is not None:
+        await _publisher.close()
+        _publisher = None
 
 
 def authenticate_channel(
-    channel: str,
-    socket_id: str,
-    custom_data: dict | None = None
-) -> str:
+    channel: str, socket_id: str, custom_data: dict | None = None
+) -> dict:
     """
     Generate authentication signature for private/presence channels.
 
@@ -90,9 +287,16 @@ def authenticate_channel(
         custom_data: Optional custom data for presence channels.
 
     Returns:
-        str: Authentication signature.
+        dict: Authentication signature, with the channel data for presence channels.
     """
-    
+    string_to_sign = f"{socket_id}:{channel}"
+    response = {}
+
     if custom_data:
-        return client.authenticate(channel, socket_id, custom_data)
-    return client.authenticate(channel, socket_id)
+        channel_data = json.dumps(custom_data)
+        string_to_sign = f"{string_to_sign}:{channel_data}"
+        response["channel_data"] = channel_data
+
+    response["auth"] = f"{soketi_settings.key}:{_sign(string_to_sign)}"
+
+    return response
@@ -0,0 +1,145 @@
+import asyncio
+from typing import Any, List, Optional
+
+from fastapi import WebSocket
+from pydantic import BaseModel
+from pydantic_settings import BaseSettings
+
+from services.json_encoding import encode_text
+from services.request_timing import timed_phase
+
+# Clients opt into batched frames with this subprotocol or with `?batch=true`
+BATCH_SUBPROTOCOL = "albums.batch.v1"
+
+
+class WebSocketSettings(BaseSettings):
+    batch_size: int = 50
+    batch_flush_interval: float = 0.25
+    per_message_deflate: bool = True
+
+    class Config:
+        env_prefix = "WEBSOCKET_"
+
+
+websocket_settings = WebSocketSettings()
+
+
+class WebSocketStats(BaseModel):
+    sessions: int = 0
+    batched_sessions: int = 0
+    frames: int = 0
+    bytes: int = 0  # Payload bytes, before permessage-deflate
+
+
+websocket_stats = WebSocketStats()
+
+
+def get_websocket_stats() -> dict:
+    sessions = max(websocket_stats.sessions, 1)
+
+    return {
+        **websocket_stats.model_dump(),
+        "frames_per_session": websocket_stats.frames / sessions,
+        "bytes_per_session": websocket_stats.bytes / sessions,
+    }
+
+
+def negotiate_batching(websocket: WebSocket) -> tuple[bool, Optional[str]]:
+    """
+    Returns whether the client asked for batched frames, and the subprotocol
+    to accept the connection with.
+    """
+    if BATCH_SUBPROTOCOL in websocket.scope.get("subprotocols", []):
+        return True, BATCH_SUBPROTOCOL
+
+    is_batched = websocket.query_params.get("batch", "").lower() in ("1", "true")
+    return is_batched, None
+
+
+class MessageSender:
+    """
+    Sends the messages of a WebSocket session, one frame per message by
+    default. When batched, messages are packed into `{"type": "batch",
+    "messages": [...]}` frames of up to `batch_size` messages, and a partial
+    batch is sent once its first message is `flush_interval` seconds old.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        is_batched: bool = False,
+        batch_size: int = websocket_settings.batch_size,
+        flush_interval: float = websocket_settings.batch_flush_interval,
+    ):
+        self.websocket = websocket
+        self.is_batched = is_batched
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.frames = 0
+        self.bytes = 0
+
+        self._batch: List[Any] = []
+        self._flush_timer: Optional[asyncio.Task] = None
+        self._send_lock = asyncio.Lock()
+
+        websocket_stats.sessions += 1
+        if is_batched:
+            websocket_stats.batched_sessions += 1
+
+    async def send(self, message: Any):
+        if not self.is_batched:
+            await self._send_frame(message)
+            return
+
+        self._batch.append(message)
+
+        if len(self._batch) >= self.batch_size:
+            await self.flush()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.create_task(self._flush_later())
+
+    async def flush(self):
+        if self._flush_timer is not None:
+            if self._flush_timer is not asyncio.current_task():
+                self._flush_timer.cancel()
+            self._flush_timer = None
+
+        if not self._batch:
+            return
+
+        messages, self._batch = self._batch, []
+        await self._send_frame({"type": "batch", "messages": messages})
+
+    async def close(self):
+        """
+        Sends what is left of the batch. Safe to call after a disconnect.
+        """
+        try:
+            await self.flush()
+        except Exception:
+            pass
+        finally:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error flushing WebSocket batch: {str(e)}")
+
+    async def _send_frame(self, message: Any):
+        with timed_phase("serialize"):
+            text = encode_text(message)
+
+        # The flush timer and the handler may both send, keep frames in order
+        async with self._send_lock:
+            await self.websocket.send_text(text)
+
+        payload_bytes = len(text.encode())
+        self.frames += 1
+        self.bytes += payload_bytes
+        websocket_stats.frames += 1
+        websocket_stats.bytes += payload_bytes
@@ -0,0 +1,48 @@
+import pytest
+
+from gateways.discogs_gateway import get_price_of_normalized_album
+from services.cache import make_cache_key
+from services.normalization import normalize_album_lookup
+
+EDITIONS = [
+    ("Led Zeppelin", "Houses of the Holy"),
+    ("Led Zeppelin", "Houses of the Holy (Remastered 2011)"),
+    ("Led Zeppelin", "Houses of the Holy (Deluxe Edition)"),
+    ("Led Zeppelin", "Houses of the Holy - 2009 Remaster"),
+    ("Led Zeppelin", "Houses Of The Holy [Remastered]"),
+    ("LED ZEPPELIN", "Houses of the Holy"),
+    ("led  zeppelin ", "houses of the holy"),
+]
+
+
+def album_cache_key(artist: str, album_name: str) -> str:
+    return make_cache_key(
+        "albums",
+        get_price_of_normalized_album.__wrapped__,
+        normalize_album_lookup(artist, album_name),
+        {},
+        hints=("upc",),
+    )
+
+
+def test_editions_share_one_lookup():
+    lookups = {normalize_album_lookup(*album) for album in EDITIONS}
+
+    assert lookups == {("led zeppelin", "houses of the holy")}
+
+
+def test_editions_share_one_cache_key():
+    assert len({album_cache_key(*album) for album in EDITIONS}) == 1
+
+
+def test_different_albums_keep_different_keys():
+    assert album_cache_key("Led Zeppelin", "Houses of the Holy") != album_cache_key(
+        "Led Zeppelin", "Physical Graffiti"
+    )
+
+
+@pytest.mark.parametrize("album_name", ["(Deluxe Edition)", "[Remastered]"])
+def test_name_made_only_of_edition_markers_is_kept(album_name):
+    _, normalized_name = normalize_album_lookup("Artist", album_name)
+
+    assert normalized_name == album_name.casefold()
@@ -0,0 +1,80 @@
+from io import BytesIO
+
+import pytest
+
+from services.normalization import normalize_album_lookup
+from services.release_index import ReleaseIndex, import_releases_dump
+
+SAMPLE_DUMP = b"""<?xml version="1.0" encoding="UTF-8"?>
+<releases>
+  <release id="30" status="Accepted">
+    <artists><artist><id>1</id><name>Nirvana (2)</name></artist></artists>
+    <title>Nevermind</title>
+    <formats><format name="Vinyl" qty="1"/></formats>
+    <identifiers>
+      <identifier type="Barcode" value="7 20642 44252 0"/>
+      <identifier type="Matrix / Runout" value="DGC-24425-A"/>
+    </identifiers>
+  </release>
+  <release id="20" status="Accepted">
+    <artists><artist><id>1</id><name>Nirvana (2)</name></artist></artists>
+    <title>Nevermind (Remastered)</title>
+    <formats><format name="CD" qty="1"/></formats>
+  </release>
+  <release id="40" status="Accepted">
+    <artists><artist><id>1</id><name>Nirvana (2)</name></artist></artists>
+    <title>Nevermind</title>
+    <formats><format name="CD" qty="1"/></formats>
+  </release>
+  <release id="50" status="Accepted">
+    <artists><artist><id>2</id><name>Portishead</name></artist></artists>
+    <title>Dummy</title>
+    <formats><format name="Cassette" qty="1"/></formats>
+    <identifiers><identifier type="Barcode" value="042282855347"/></identifiers>
+  </release>
+  <release id="55" status="Accepted">
+    <artists><artist><id>2</id><name>Portishead</name></artist></artists>
+    <title>Dummy (Reissue)</title>
+    <identifiers><identifier type="Barcode" value="042282855347"/></identifiers>
+  </release>
+  <release id="60" status="Accepted">
+    <title>Release Without Artist</title>
+  </release>
+</releases>
+"""
+
+
+@pytest.fixture
+def release_index(tmp_path) -> ReleaseIndex:
+    index_path = str(tmp_path / "releases.sqlite")
+    assert import_releases_dump(BytesIO(SAMPLE_DUMP), index_path) == 5
+
+    return ReleaseIndex(index_path)
+
+
+def test_lookup_prefers_the_oldest_cd_release(release_index):
+    lookup = normalize_album_lookup("Nirvana", "Nevermind - 2011 Remaster")
+
+    assert release_index.lookup(*lookup) == 20
+
+
+def test_lookup_without_a_cd_release(release_index):
+    assert release_index.lookup(*normalize_album_lookup("Portishead", "Dummy")) == 50
+
+
+def test_lookup_of_an_unknown_album(release_index):
+    assert release_index.lookup(*normalize_album_lookup("Portishead", "Third")) is None
+
+
+def test_lookup_by_upc_ignores_barcode_formatting(release_index):
+    # Spotify writes the UPC as 13 digits, Discogs as printed on the sleeve
+    assert release_index.lookup_barcode("0720642442520") == 30
+
+
+def test_lookup_by_barcode_prefers_the_oldest_release(release_index):
+    assert release_index.lookup_barcode("042282855347") == 50
+
+
+def test_lookup_of_an_unknown_barcode(release_index):
+    assert release_index.lookup_barcode("0000000000000") is None
+    assert release_index.lookup_barcode("DGC-24425-A") is None
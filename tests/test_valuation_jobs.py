@@ -0,0 +1,103 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from gateways.valuation_jobs import ValuationJobQueueFull, ValuationJobRunner
+from services import redis_client
+
+ACCESS_TOKEN = "token"
+
+PAGES = [
+    [("Portishead", "Dummy"), ("Massive Attack", "Mezzanine")],
+    [("Tricky", "Maxinquaye")],
+]
+
+PRICES = {"Dummy": (20.0, True), "Mezzanine": (15.5, True), "Maxinquaye": (0.0, False)}
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    monkeypatch.setattr(redis_client, "_redis", fakeredis.FakeAsyncRedis())
+
+
+async def fetch_album_pages(access_token: str):
+    assert access_token == ACCESS_TOKEN
+
+    total = sum(len(page) for page in PAGES)
+    for page in PAGES:
+        yield total, page
+
+
+def test_run_job_saves_progress_and_result():
+    async def run():
+        progress = []
+
+        async def price_albums(albums):
+            status = await runner.get_status(job_id, ACCESS_TOKEN)
+            progress.append((status["status"], status["priced"]))
+            return [PRICES[album_name] for _, album_name in albums]
+
+        runner = ValuationJobRunner(fetch_album_pages, price_albums, workers=0)
+        job_id = await runner.submit(ACCESS_TOKEN)
+        await runner.run_job(job_id, ACCESS_TOKEN)
+
+        status = await runner.get_status(job_id, ACCESS_TOKEN)
+        result = await runner.get_result(job_id, ACCESS_TOKEN)
+        return progress, status, result
+
+    progress, status, result = asyncio.run(run())
+
+    assert progress == [("running", 0), ("running", 2)]
+    assert status["status"] == "done"
+    assert (status["priced"], status["total"]) == (3, 3)
+    assert result.total == 35.5
+    assert [album.valid for album in result.albums_with_price] == [True, True, False]
+
+
+def test_failed_job_reports_its_error():
+    async def run():
+        async def price_albums(albums):
+            raise RuntimeError("Discogs is down")
+
+        runner = ValuationJobRunner(fetch_album_pages, price_albums, workers=1)
+        job_id = await runner.submit(ACCESS_TOKEN)
+        await runner._queue.join()
+        await runner.stop()
+
+        status = await runner.get_status(job_id, ACCESS_TOKEN)
+        return runner, status, await runner.get_result(job_id, ACCESS_TOKEN)
+
+    runner, status, result = asyncio.run(run())
+
+    assert status["status"] == "failed"
+    assert status["error"] == "Discogs is down"
+    assert result is None
+    assert runner.stats.failed == 1
+
+
+def test_jobs_are_only_visible_to_their_owner():
+    async def run():
+        runner = ValuationJobRunner(fetch_album_pages, workers=0)
+        job_id = await runner.submit(ACCESS_TOKEN)
+        return await runner.get_status(job_id, "another token")
+
+    assert asyncio.run(run()) is None
+
+
+def test_concurrent_submits_cannot_overfill_the_queue():
+    async def run():
+        runner = ValuationJobRunner(fetch_album_pages, workers=0, max_queued_jobs=1)
+        outcomes = await asyncio.gather(
+            runner.submit(ACCESS_TOKEN),
+            runner.submit(ACCESS_TOKEN),
+            return_exceptions=True,
+        )
+        keys = await redis_client.get_redis().keys("valuation_job:*")
+        return outcomes, keys
+
+    outcomes, keys = asyncio.run(run())
+
+    assert isinstance(outcomes[0], str)
+    assert isinstance(outcomes[1], ValuationJobQueueFull)
+    assert keys == [f"valuation_job:{outcomes[0]}".encode()]
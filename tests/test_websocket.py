@@ -0,0 +1,95 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import urlencode
+
+import httpx
+import pytest
+
+from services import http_client
+from services.websocket import EventPublisher, soketi_settings
+
+
+class SoketiStandIn:
+    """
+    Answers the Pusher HTTP API like Soketi, after checking each request's
+    signature, and keeps the events it received.
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.requests = 0
+        self.events = []
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        await asyncio.sleep(self.delay)
+
+        params = dict(request.url.params)
+        signature = params.pop("auth_signature")
+        expected_signature = hmac.new(
+            soketi_settings.secret.encode(),
+            f"POST\n{request.url.path}\n{urlencode(sorted(params.items()))}".encode(),
+            hashlib.sha256,
+        ).hexdigest()
+
+        assert hmac.compare_digest(signature, expected_signature)
+        assert params["auth_key"] == soketi_settings.key
+        assert params["body_md5"] == hashlib.md5(request.content).hexdigest()
+        assert request.url.path == f"/apps/{soketi_settings.app_id}/batch_events"
+
+        batch = json.loads(request.content)["batch"]
+        assert len(batch) <= 10
+
+        self.events.extend(batch)
+        return httpx.Response(200, json={})
+
+
+@pytest.fixture
+def soketi(monkeypatch) -> SoketiStandIn:
+    stand_in = SoketiStandIn()
+    monkeypatch.setattr(
+        http_client,
+        "_client",
+        httpx.AsyncClient(transport=httpx.MockTransport(stand_in.handle)),
+    )
+    return stand_in
+
+
+def test_events_are_sent_in_signed_batches(soketi):
+    async def run():
+        publisher = EventPublisher(batch_size=10, linger=0.05)
+        for number in range(95):
+            await publisher.publish("valuations", "album", {"index": number})
+        await publisher.close()
+        return publisher
+
+    publisher = asyncio.run(run())
+
+    assert soketi.requests == 10
+    assert [json.loads(event["data"])["index"] for event in soketi.events] == list(
+        range(95)
+    )
+    assert publisher.stats.published == 95
+    assert publisher.stats.failed_events == 0
+
+
+def test_close_drops_the_events_soketi_is_too_slow_for(soketi):
+    soketi.delay = 30.0
+
+    async def run():
+        publisher = EventPublisher(batch_size=10, linger=0.01, close_timeout=0.2)
+        for number in range(50):
+            await publisher.publish("valuations", "album", {"index": number})
+
+        started_at = time.monotonic()
+        await publisher.close()
+        return publisher, time.monotonic() - started_at
+
+    publisher, close_duration = asyncio.run(run())
+
+    assert close_duration < 1.0
+    assert soketi.events == []
+    assert publisher.stats.failed_events == 50
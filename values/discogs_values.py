@@ -1,17 +1,49 @@
-from typing import Optional
-from pydantic import BaseModel, Field
+from typing import List, Optional
+from pydantic import BaseModel, ConfigDict, Field
 from decimal import Decimal, ROUND_HALF_UP
 
 from pydantic_settings import BaseSettings
 
 
 class DiscogsSettings(BaseSettings):
+    api_url: str = "https://api.discogs.com"  # Pointed at a stand-in by benchmarks
     access_token: Optional[str] = None
+    release_index_path: Optional[str] = None  # Built by services.release_index
+    concurrency: int = 8  # Max album lookups in flight per pricing request
+    requests_per_minute: int = 60  # Shared by every worker
+    rate_limit_burst: int = 5
+    rate_limit_max_wait: float = 120.0
+    max_retries: int = 3  # Retries for requests rejected with a 429
+    release_ttl: int = 7776000  # 90 days, releases found by a search rarely change
+    price_suggestions_ttl: int = 432000  # 5 days, kept below price_ttl
+    price_ttl: int = 864000  # 10 days
+    price_not_found_ttl: int = 21600  # 6 hours
+    price_stale_ttl: int = 86400  # Served while being refreshed
+    price_ttl_jitter: float = 0.1
+    warmer_enabled: bool = True
+    warmer_interval: float = 60.0  # Seconds between cache warming rounds
+    warmer_candidates: int = 500  # Most requested albums checked each round
+    warmer_refresh_ahead: int = 86400  # Refresh prices this close to going stale
+    warmer_reserve_tokens: float = 2.0  # Rate limit tokens left to interactive use
+    warmer_popularity_half_life: int = 604800  # Lookup counts halve in a week
 
     class Config:
         env_prefix = "DISCOGS_"
 
 
+class DiscogsSearchResult(BaseModel):
+    id: int
+    title: Optional[str] = None
+
+    model_config = ConfigDict(extra="ignore")
+
+
+class DiscogsSearchResponse(BaseModel):
+    results: List[DiscogsSearchResult] = []
+
+    model_config = ConfigDict(extra="ignore")
+
+
 class DiscogsPrice(BaseModel):
     currency: str
     value: Decimal
@@ -1,5 +1,5 @@
 from typing import List, Optional
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, TypeAdapter
 from pydantic_settings import BaseSettings
 
 
@@ -14,6 +14,17 @@ class SpotifyAppCredentials(BaseSettings):
         env_prefix = "SPOTIFY_"
 
 
+class SpotifyClientSettings(BaseSettings):
+    url: str = "https://api.spotify.com/v1"  # Pointed at a stand-in by benchmarks
+    page_size: int = 50  # Max allowed by /v1/me/albums
+    page_concurrency: int = 4  # Max saved album pages fetched at once
+    token_cache_max_ttl: int = 3600  # Spotify access tokens last an hour
+    token_cache_default_ttl: int = 300  # For tokens whose expiry isn't known
+
+    class Config:
+        env_prefix = "SPOTIFY_API_"
+
+
 class SpotifyUserCredentials(BaseModel):
     access_token: str
     token_type: str
@@ -159,3 +170,64 @@ class SpotifyAlbumListResponse(BaseModel):
     total: int
 
     model_config = ConfigDict(extra="ignore")
+
+
+# Lean versions of the saved albums models, for the valuation paths. They keep
+# the same attribute paths but only the fields those paths read, so the track
+# lists, markets and copyrights of each album are skipped while parsing.
+
+
+class LeanArtist(BaseModel):
+    name: Optional[str] = None
+
+    model_config = ConfigDict(extra="ignore")
+
+
+class LeanImage(BaseModel):
+    url: str
+
+    model_config = ConfigDict(extra="ignore")
+
+
+class LeanExternalID(BaseModel):
+    upc: Optional[str] = None
+
+    model_config = ConfigDict(extra="ignore")
+
+
+class LeanAlbum(BaseModel):
+    id: Optional[str] = None
+    name: Optional[str] = None
+    artists: Optional[List[LeanArtist]] = None
+    images: Optional[List[LeanImage]] = None
+    release_date: Optional[str] = None
+    external_ids: Optional[LeanExternalID] = None
+
+    model_config = ConfigDict(extra="ignore")
+
+
+class LeanAlbumListItem(BaseModel):
+    added_at: str
+    album: LeanAlbum
+
+    model_config = ConfigDict(extra="ignore")
+
+
+class LeanAlbumListResponse(BaseModel):
+    next: Optional[str] = None
+    offset: int
+    items: List[LeanAlbumListItem]
+    total: int
+
+    model_config = ConfigDict(extra="ignore")
+
+
+lean_album_list_adapter = TypeAdapter(LeanAlbumListResponse)
+
+
+def parse_lean_album_list(content: bytes) -> LeanAlbumListResponse:
+    """
+    Parses a saved albums page straight from the response bytes with
+    pydantic-core's JSON parser, without building the intermediate dicts.
+    """
+    return lean_album_list_adapter.validate_json(content)